@@ -4,15 +4,32 @@ import asyncio
 import secrets
 from datetime import datetime
 from aiohttp import web, ClientSession
-from telegram import Update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
+    MessageHandler,
     CallbackContext,
     filters,
 )
 from config import Config  # Ensure Config contains required keys
-from database import create_movie  # Assuming this is implemented
+from database import (
+    bulk_create_movies, get_movie_by_stream_id, get_movie_stats, verify_url_token,
+    get_movies_by_stream_ids, load_stream_filter, stream_filter
+)
+from user_registry import user_registry, register_user_tracking
+from log_shipper import install_log_shipper
+from broadcast import broadcast_command, register_broadcast_resumer, suspend_broadcasts
+from lifecycle import Lifecycle
+from invalidation import create_invalidation_bus
+from upload_intake import upload_intake, handle_upload
+from templates import START_MESSAGE, BOT_STATS_TEXT, format_size
+from pool_metrics import pool_metrics
+from worker_pool import worker_directory
+from catalogue_io import export_command, import_command
+from dedupe import fingerprint_urls
+from shortener import SHORTENERS
+from popularity import popularity_tracker, register_popularity
 
 # Configure logging
 logging.basicConfig(
@@ -21,6 +38,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+START_TIME = datetime.utcnow()
+
+def format_uptime(delta) -> str:
+    """Format a timedelta as days, hours and minutes."""
+    minutes, _ = divmod(int(delta.total_seconds()), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h {minutes}m"
+
 async def check_shortener_apis():
     """Check if URL shortener APIs are working."""
     async with ClientSession() as session:
@@ -86,32 +112,38 @@ async def batch_command(update: Update, context: CallbackContext) -> None:
 
         status_message = await update.message.reply_text("🔄 Processing batch upload...")
         
-        success_count, failed_count = 0, 0
-        results = []
+        entries, results = [], []
+        failed_count = 0
 
         for arg in context.args:
-            try:
-                if "|" not in arg:
-                    results.append(f"❌ Invalid format: {arg}")
-                    failed_count += 1
-                    continue
-
-                title, file_url = arg.split("|", 1)
-                await create_movie(
-                    title=title.strip(),
-                    stream_id=secrets.token_hex(8),
-                    file_url=file_url.strip(),
-                    uploader_id=str(user_id),
-                )
-                results.append(f"✅ Added: {title}")
-                success_count += 1
-            except Exception as e:
-                results.append(f"❌ Error adding {title}: {e}")
+            if "|" not in arg:
+                results.append(f"❌ Invalid format: {arg}")
                 failed_count += 1
+                continue
+
+            title, file_url = arg.split("|", 1)
+            entries.append({
+                "title": title.strip(),
+                "file_url": file_url.strip(),
+                "stream_id": secrets.token_hex(8),
+            })
+
+        fingerprints = await fingerprint_urls([entry["file_url"] for entry in entries])
+        for entry, fingerprint in zip(entries, fingerprints):
+            entry["fingerprint"] = fingerprint
+
+        outcome = bulk_create_movies(entries, uploader_id=str(user_id)) if entries else {
+            "created": [], "duplicates": [], "failed": []
+        }
+        results.extend(f"✅ Added: {movie['title']}" for movie in outcome["created"])
+        results.extend(f"♻️ Already stored: {movie['title']}" for movie in outcome["duplicates"])
+        results.extend(f"❌ Could not store: {movie['title']}" for movie in outcome["failed"])
+        failed_count += len(outcome["failed"])
 
         result_text = (
             f"📊 Batch Upload Results:\n\n"
-            f"✅ Successfully added: {success_count}\n"
+            f"✅ Successfully added: {len(outcome['created'])}\n"
+            f"♻️ Duplicates skipped: {len(outcome['duplicates'])}\n"
             f"❌ Failed: {failed_count}\n\n"
             + "\n".join(results)
         )
@@ -121,9 +153,175 @@ async def batch_command(update: Update, context: CallbackContext) -> None:
         logger.error(f"Error in batch command: {e}")
         await update.message.reply_text("❌ An error occurred during batch upload.")
 
+async def set_ban(update: Update, context: CallbackContext, banned: bool) -> None:
+    """Ban or unban the user ID given as the command argument."""
+    try:
+        if not user_registry.is_admin(update.effective_user.id):
+            await update.message.reply_text("⚠️ This command is only for admins!")
+            return
+
+        if not context.args or not context.args[0].lstrip("-").isdigit():
+            command = "ban" if banned else "unban"
+            await update.message.reply_text(f"📝 Usage: /{command} user_id")
+            return
+
+        target_id = int(context.args[0])
+        if banned and user_registry.is_admin(target_id):
+            await update.message.reply_text("⚠️ Admins cannot be banned!")
+            return
+
+        user_registry.set_banned(target_id, banned)
+        action = "banned" if banned else "unbanned"
+        await update.message.reply_text(f"✅ User {target_id} has been {action}.")
+
+    except Exception as e:
+        logger.error(f"Error updating ban status: {e}")
+        await update.message.reply_text("❌ An error occurred while updating the user.")
+
+async def ban_command(update: Update, context: CallbackContext) -> None:
+    """Handle /ban command for admins."""
+    await set_ban(update, context, True)
+
+async def unban_command(update: Update, context: CallbackContext) -> None:
+    """Handle /unban command for admins."""
+    await set_ban(update, context, False)
+
+async def stats_command(update: Update, context: CallbackContext) -> None:
+    """Handle /stats command for admins."""
+    try:
+        if not user_registry.is_admin(update.effective_user.id):
+            await update.message.reply_text("⚠️ This command is only for admins!")
+            return
+
+        user_registry.flush()
+        stats = get_movie_stats()
+        await update.message.reply_text(
+            BOT_STATS_TEXT.render(
+                total_users=user_registry.count(),
+                total_files=stats["total_movies"],
+                total_views=stats["total_views"],
+                storage_used=format_size(stats["total_size"]),
+                uptime=format_uptime(datetime.utcnow() - START_TIME),
+            ),
+            parse_mode=BOT_STATS_TEXT.parse_mode,
+        )
+
+    except Exception as e:
+        logger.error(f"Error in stats command: {e}")
+        await update.message.reply_text("❌ An error occurred while fetching statistics.")
+
+async def poolstats_command(update: Update, context: CallbackContext) -> None:
+    """Handle /poolstats command: show MongoDB connection pool wait times."""
+    try:
+        if not user_registry.is_admin(update.effective_user.id):
+            await update.message.reply_text("⚠️ This command is only for admins!")
+            return
+
+        metrics = pool_metrics.snapshot()
+        histogram = "\n".join(
+            f"  {bucket}: {count:,}" for bucket, count in metrics["wait_histogram"].items() if count
+        ) or "  no checkouts yet"
+        failures = ", ".join(
+            f"{reason}: {count}" for reason, count in metrics["checkout_failures"].items()
+        ) or "none"
+        await update.message.reply_text(
+            f"🗄 MongoDB Pool ({Config.MONGO_POOL_PROFILE})\n\n"
+            f"🔌 Open connections: {metrics['open_connections']}\n"
+            f"📤 Checked out now: {metrics['checked_out']}\n"
+            f"🔁 Checkouts: {metrics['checkouts']:,}\n"
+            f"⏱ Wait avg/max: {metrics['wait_avg_ms']:.2f} / {metrics['wait_max_ms']:.2f} ms\n"
+            f"📊 Wait histogram:\n{histogram}\n"
+            f"❌ Checkout failures: {failures}\n"
+            f"♻️ Pool clears: {metrics['pool_clears']}"
+        )
+
+    except Exception as e:
+        logger.error(f"Error in poolstats command: {e}")
+        await update.message.reply_text("❌ An error occurred while fetching pool statistics.")
+
+async def trending_command(update: Update, context: CallbackContext) -> None:
+    """Handle /trending command: list the movies with the highest decayed view scores."""
+    try:
+        ranking = popularity_tracker.top(10)
+        movies_by_id = {
+            movie["stream_id"]: movie
+            for movie in get_movies_by_stream_ids([stream_id for stream_id, _ in ranking])
+        }
+        lines = []
+        for stream_id, score in ranking:
+            movie = movies_by_id.get(stream_id)
+            if not movie:
+                continue
+            link = movie.get("short_url_get2short") or movie.get("short_url_modijiurl")
+            title = f"{movie['title']} ({link})" if link else movie["title"]
+            lines.append(f"{len(lines) + 1}. {title} · 👁 {movie.get('views', 0):,}")
+
+        if not lines:
+            await update.message.reply_text("📉 Nothing is trending yet.")
+            return
+        await update.message.reply_text(
+            "🔥 Trending now:\n\n" + "\n".join(lines),
+            disable_web_page_preview=True,
+        )
+
+    except Exception as e:
+        logger.error(f"Error in trending command: {e}")
+        await update.message.reply_text("❌ An error occurred while fetching trending movies.")
+
 async def start(update: Update, context: CallbackContext) -> None:
-    """Handle /start command."""
-    await update.message.reply_text("Welcome to the bot!")
+    """Handle /start, including deep links from short links that carry a stream_id."""
+    if context.args:
+        await start_from_link(update, context.args[0])
+        return
+    user = update.effective_user
+    await update.message.reply_text(
+        START_MESSAGE.render(first_name=user.first_name, username=user.username),
+        parse_mode=START_MESSAGE.parse_mode,
+    )
+
+async def hand_off(update: Update, stream_id: str, url: str) -> None:
+    """Reply with the worker bot that should deliver a movie and the link to send it."""
+    worker = worker_directory.pick(stream_id)
+    if not worker:
+        await update.message.reply_text("⏳ All download bots are busy. Please try again in a minute.")
+        return
+
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"📥 Open @{worker['username']}", url=f"https://t.me/{worker['username']}")]
+    ])
+    await update.message.reply_text(
+        f"📥 Send this link to @{worker['username']} to get your file:\n\n{url}",
+        reply_markup=keyboard,
+        disable_web_page_preview=True,
+    )
+
+async def start_from_link(update: Update, stream_id: str) -> None:
+    """Hand a user who opened a short link (t.me/<bot>?start=<stream_id>) to a worker."""
+    try:
+        movie = get_movie_by_stream_id(stream_id)
+        url = next((movie[field] for field in SHORTENERS if movie.get(field)), None) if movie else None
+        if not url:
+            await update.message.reply_text(Config.USER_REPLY_TEXT)
+            return
+        await hand_off(update, stream_id, url)
+
+    except Exception as e:
+        logger.error(f"Error handling start link {stream_id}: {e}")
+        await update.message.reply_text("❌ An error occurred. Please try again later.")
+
+async def handoff_to_worker(update: Update, context: CallbackContext) -> None:
+    """Point a user who sent a file link at the worker bot that should deliver it."""
+    try:
+        url = update.message.text.strip()
+        verification = verify_url_token(url)
+        if not verification:
+            await update.message.reply_text(Config.USER_REPLY_TEXT)
+            return
+        await hand_off(update, verification["stream_id"], url)
+
+    except Exception as e:
+        logger.error(f"Error handing off to worker: {e}")
+        await update.message.reply_text("❌ An error occurred. Please try again later.")
 
 async def web_app():
     """Create a minimal web app for Heroku."""
@@ -131,16 +329,37 @@ async def web_app():
     return app
 
 async def main():
-    """Start the bot."""
+    """Start the bot and run it until a stop signal, then drain."""
+    application = None
+    runner = None
+    lifecycle = Lifecycle(Config.SHUTDOWN_TIMEOUT)
+    invalidation_bus = create_invalidation_bus("bot")
     try:
+        # Load the stream ID filter before taking any links
+        load_stream_filter()
+
         # Check APIs and Heroku status
         await check_shortener_apis()
         await check_heroku_status()
 
         # Initialize the bot application
         application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+        register_user_tracking(application, main_bot=True)
+        register_popularity(application)
         application.add_handler(CommandHandler("start", start))
         application.add_handler(CommandHandler("batch", batch_command))
+        application.add_handler(CommandHandler("stats", stats_command))
+        application.add_handler(CommandHandler("ban", ban_command))
+        application.add_handler(CommandHandler("unban", unban_command))
+        application.add_handler(CommandHandler("broadcast", broadcast_command))
+        application.add_handler(CommandHandler("poolstats", poolstats_command))
+        application.add_handler(CommandHandler("trending", trending_command))
+        application.add_handler(CommandHandler("export", export_command))
+        application.add_handler(CommandHandler("import", import_command))
+        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handoff_to_worker))
+        application.add_handler(
+            MessageHandler(filters.Document.ALL | filters.VIDEO | filters.AUDIO, handle_upload)
+        )
 
         # Start web server
         port = int(os.environ.get("PORT", "8443"))
@@ -155,12 +374,31 @@ async def main():
         # Run the bot
         await application.initialize()
         await application.start()
-        await application.run_polling()
+        upload_intake.start(application.bot)
+        await application.updater.start_polling()
+        log_shipper = install_log_shipper(application.bot)
+        invalidation_bus.start(asyncio.get_running_loop())
+        register_broadcast_resumer(application)
+
+        # Broadcasts checkpoint and resume; buffered writes are flushed on the way out
+        lifecycle.on_drain(suspend_broadcasts)
+        # Queued uploads get half of the drain deadline, in-flight handlers the rest
+        lifecycle.on_drain(lambda: upload_intake.stop(lifecycle.remaining() / 2))
+        lifecycle.on_shutdown(user_registry.flush)
+        lifecycle.on_shutdown(invalidation_bus.stop)
+        lifecycle.on_shutdown(stream_filter.save)
+        if log_shipper:
+            lifecycle.on_shutdown(log_shipper.stop)
+
+        await lifecycle.wait()
 
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
     finally:
-        await application.shutdown()
+        if application is not None:
+            await lifecycle.drain([application])
+        if runner is not None:
+            await runner.cleanup()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,358 @@
+import time
+import asyncio
+import logging
+import secrets
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from telegram import Bot, Update
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import Application, CallbackContext
+
+from config import Config
+from models import broadcasts, users
+from rate_limiter import TokenBucket
+from user_registry import user_registry
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the user can never receive messages from the bot again
+# Users who blocked the main bot or deleted their account
+BLOCKED_ERRORS = ('bot was blocked', 'user is deactivated')
+# Users the main bot can't message, e.g. because they only used a worker bot
+UNREACHABLE_ERRORS = ("bot can't initiate conversation", 'chat not found', 'user not found')
+
+RESULTS = ('sent', 'blocked', 'unreachable', 'failed')
+
+# Users the main bot can't reach are marked rather than deleted, since they
+# may still use the worker bots; user tracking clears the mark when they
+# next talk to the main bot
+RECIPIENTS_QUERY = {'is_banned': {'$ne': True}, 'unreachable_main': {'$ne': True}}
+
+# Task per running broadcast, so /broadcast cancel can stop it
+running_broadcasts: Dict[ObjectId, asyncio.Task] = {}
+
+# Broadcasts stopped by an admin, as opposed to by process shutdown
+cancelled_broadcasts: Set[ObjectId] = set()
+
+# Set on shutdown: broadcasts stop after their current chunk
+_suspending = False
+
+# Identifies this process as the owner of the broadcasts it runs
+OWNER_ID = f"{Config.INSTANCE_NAME}:{secrets.token_hex(4)}"
+
+# A job whose lease is older than this is considered abandoned and can be
+# claimed by another process; running jobs renew it after every chunk
+LEASE_SECONDS = 120
+RESUME_INTERVAL = 30  # seconds
+
+
+def format_duration(seconds: float) -> str:
+    """Format seconds as h:mm:ss."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def processed_count(job: Dict) -> int:
+    """Recipients handled so far, whatever the outcome."""
+    return sum(job.get(result, 0) for result in RESULTS)
+
+
+def render_status(job: Dict, rate: float, finished: bool = False) -> str:
+    """Build the broadcast status message text."""
+    done = processed_count(job)
+    total = max(job['total'], done)
+    remaining = total - done
+    eta = format_duration(remaining / rate) if rate > 0 else "--"
+    title = {
+        'running': "📣 Broadcast in progress",
+        'completed': "✅ Broadcast completed",
+        'cancelled': "🛑 Broadcast cancelled"
+    }.get(job['status'], "📣 Broadcast")
+    lines = [
+        f"{title}\n",
+        f"✅ Sent: {job['sent']:,}",
+        f"🚫 Blocked/deleted: {job['blocked']:,}",
+        f"👻 Never started the bot: {job.get('unreachable', 0):,}",
+        f"❌ Failed: {job['failed']:,}",
+        f"📊 Progress: {done:,}/{total:,} ({done / total:.1%})" if total else "📊 Progress: 0/0",
+        f"⚡️ Speed: {rate:.1f} msg/s",
+    ]
+    if not finished:
+        lines.append(f"⏳ ETA: {eta}")
+    return "\n".join(lines)
+
+
+async def send_one(bot: Bot, bucket: TokenBucket, job: Dict, telegram_id: str) -> str:
+    """
+    Copy the broadcast message to one user.
+
+    Returns:
+        'sent', 'blocked', 'unreachable' or 'failed'
+    """
+    for _ in range(3):
+        await bucket.acquire()
+        try:
+            await bot.copy_message(
+                chat_id=int(telegram_id),
+                from_chat_id=job['from_chat_id'],
+                message_id=job['message_id'],
+                disable_notification=True
+            )
+            return 'sent'
+        except RetryAfter as e:
+            # Flood limit is global to the bot, so hold back every sender
+            bucket.tokens = -e.retry_after * bucket.rate
+            await asyncio.sleep(e.retry_after)
+        except (Forbidden, BadRequest) as e:
+            reason = str(e).lower()
+            if any(error in reason for error in BLOCKED_ERRORS):
+                return 'blocked'
+            if any(error in reason for error in UNREACHABLE_ERRORS):
+                return 'unreachable'
+            logger.warning(f"Broadcast to {telegram_id} failed: {e}")
+            return 'failed'
+        except TelegramError as e:
+            logger.warning(f"Broadcast to {telegram_id} failed: {e}")
+            return 'failed'
+    return 'failed'
+
+
+async def run_broadcast(bot: Bot, job: Dict) -> None:
+    """
+    Send a broadcast to every user, resuming from the job's checkpoint.
+
+    Recipients are streamed in _id order with a cursor and sent in chunks of
+    BROADCAST_CHUNK_SIZE concurrently, paced by a token bucket at
+    BROADCAST_RATE messages per second. After each chunk the last _id and
+    counters are checkpointed and users the main bot can't reach are
+    marked so later broadcasts skip them.
+    """
+    bucket = TokenBucket(Config.BROADCAST_RATE, Config.BROADCAST_RATE)
+    started = time.monotonic()
+    job.setdefault('unreachable', 0)
+    processed_at_start = processed_count(job)
+    last_status = 0.0
+
+    query = dict(RECIPIENTS_QUERY)
+    if job.get('last_user_id'):
+        query['_id'] = {'$gt': job['last_user_id']}
+    cursor = users.find(query, {'telegram_id': 1}).sort('_id', 1).batch_size(Config.BROADCAST_CHUNK_SIZE)
+
+    try:
+        while True:
+            if _suspending:
+                logger.info(f"Broadcast {job['_id']} suspended after user {job.get('last_user_id')}")
+                return
+            chunk: List[Dict] = []
+            for doc in cursor:
+                chunk.append(doc)
+                if len(chunk) >= Config.BROADCAST_CHUNK_SIZE:
+                    break
+            if not chunk:
+                break
+
+            results = await asyncio.gather(
+                *(send_one(bot, bucket, job, doc['telegram_id']) for doc in chunk)
+            )
+            unreachable = [
+                doc['telegram_id'] for doc, result in zip(chunk, results) if result in ('blocked', 'unreachable')
+            ]
+            for result in RESULTS:
+                job[result] += results.count(result)
+            job['last_user_id'] = chunk[-1]['_id']
+
+            if unreachable:
+                users.update_many(
+                    {'telegram_id': {'$in': unreachable}},
+                    {'$set': {'unreachable_main': True}}
+                )
+            now_utc = datetime.utcnow()
+            result = broadcasts.update_one(
+                {'_id': job['_id'], 'owner': OWNER_ID},
+                {'$set': {
+                    'last_user_id': job['last_user_id'],
+                    'sent': job['sent'],
+                    'blocked': job['blocked'],
+                    'unreachable': job['unreachable'],
+                    'failed': job['failed'],
+                    'updated_at': now_utc,
+                    'lease_until': now_utc + timedelta(seconds=LEASE_SECONDS)
+                }}
+            )
+            if not result.matched_count:
+                logger.warning(f"Broadcast {job['_id']} was claimed by another process, stopping")
+                return
+
+            now = time.monotonic()
+            if now - last_status >= Config.BROADCAST_STATUS_INTERVAL:
+                last_status = now
+                processed = processed_count(job) - processed_at_start
+                await update_status(bot, job, processed / max(now - started, 1e-6))
+
+        job['status'] = 'completed'
+    except asyncio.CancelledError:
+        # On shutdown the job stays 'running' and resumes from its checkpoint
+        if job['_id'] in cancelled_broadcasts:
+            cancelled_broadcasts.discard(job['_id'])
+            job['status'] = 'cancelled'
+        raise
+    finally:
+        cursor.close()
+        running_broadcasts.pop(job['_id'], None)
+        if job['status'] == 'running':
+            # Hand the job over at once instead of waiting for the lease to run out
+            broadcasts.update_one(
+                {'_id': job['_id'], 'owner': OWNER_ID},
+                {'$set': {'lease_until': datetime.utcnow()}, '$unset': {'owner': ''}}
+            )
+        else:
+            broadcasts.update_one(
+                {'_id': job['_id'], 'owner': OWNER_ID},
+                {'$set': {'status': job['status'], 'finished_at': datetime.utcnow()}}
+            )
+            processed = processed_count(job) - processed_at_start
+            await update_status(bot, job, processed / max(time.monotonic() - started, 1e-6), finished=True)
+
+
+async def update_status(bot: Bot, job: Dict, rate: float, finished: bool = False) -> None:
+    """Edit the admin's status message with current progress."""
+    try:
+        await bot.edit_message_text(
+            render_status(job, rate, finished),
+            chat_id=job['status_chat_id'],
+            message_id=job['status_message_id']
+        )
+    except TelegramError as e:
+        logger.debug(f"Could not update broadcast status: {e}")
+
+
+def start_broadcast(application: Application, job: Dict) -> None:
+    """Run a broadcast job in the background."""
+    task = application.create_task(run_broadcast(application.bot, job))
+    running_broadcasts[job['_id']] = task
+
+
+def suspend_broadcasts() -> None:
+    """
+    Stop running broadcasts for shutdown once their current chunk is checkpointed.
+
+    They stay 'running' in the database and resume_broadcasts picks them up
+    from that checkpoint in the next process.
+    """
+    global _suspending
+    _suspending = True
+
+
+def claim_broadcast(job_id: ObjectId) -> Optional[Dict]:
+    """
+    Take ownership of a running broadcast unless another process holds a fresh lease.
+
+    Returns:
+        The claimed job, or None if it is owned elsewhere or no longer running
+    """
+    now = datetime.utcnow()
+    return broadcasts.find_one_and_update(
+        {
+            '_id': job_id,
+            'status': 'running',
+            '$or': [
+                {'owner': {'$exists': False}},
+                {'owner': OWNER_ID},
+                {'lease_until': {'$lt': now}}
+            ]
+        },
+        {'$set': {'owner': OWNER_ID, 'lease_until': now + timedelta(seconds=LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def resume_broadcasts(application: Application) -> None:
+    """Restart running broadcasts that no live process owns."""
+    if _suspending:
+        return
+    for job in broadcasts.find({'status': 'running'}, {'_id': 1}):
+        if job['_id'] in running_broadcasts:
+            continue
+        claimed = claim_broadcast(job['_id'])
+        if claimed:
+            logger.info(f"Resuming broadcast {claimed['_id']} after user {claimed.get('last_user_id')}")
+            start_broadcast(application, claimed)
+
+
+async def _resume_broadcasts(context: CallbackContext) -> None:
+    try:
+        resume_broadcasts(context.application)
+    except Exception as e:
+        logger.error(f"Error resuming broadcasts: {e}")
+
+
+def register_broadcast_resumer(application: Application) -> None:
+    """
+    Periodically pick up broadcasts left by a stopped process.
+
+    During a rolling restart the old process may still hold the lease when
+    the new one starts, so resuming is retried until the lease is released
+    or runs out.
+    """
+    application.job_queue.run_repeating(_resume_broadcasts, interval=RESUME_INTERVAL, first=0)
+
+
+async def broadcast_command(update: Update, context: CallbackContext) -> None:
+    """Handle /broadcast for admins: reply to a message to send it to every user."""
+    try:
+        if not user_registry.is_admin(update.effective_user.id):
+            await update.message.reply_text("⚠️ This command is only for admins!")
+            return
+
+        if context.args and context.args[0].lower() == 'cancel':
+            if not running_broadcasts:
+                await update.message.reply_text("ℹ️ No broadcast is running.")
+                return
+            for job_id, task in list(running_broadcasts.items()):
+                cancelled_broadcasts.add(job_id)
+                task.cancel()
+            await update.message.reply_text("🛑 Broadcast cancelled.")
+            return
+
+        source = update.message.reply_to_message
+        if not source:
+            await update.message.reply_text(
+                "📝 Usage: reply to a message with /broadcast to send it to all users.\n"
+                "Use /broadcast cancel to stop a running broadcast."
+            )
+            return
+
+        if running_broadcasts:
+            await update.message.reply_text("⚠️ A broadcast is already running.")
+            return
+
+        user_registry.flush()
+        status_message = await update.message.reply_text("📣 Starting broadcast...")
+        job = {
+            '_id': ObjectId(),
+            'status': 'running',
+            'from_chat_id': source.chat_id,
+            'message_id': source.message_id,
+            'status_chat_id': status_message.chat_id,
+            'status_message_id': status_message.message_id,
+            'last_user_id': None,
+            'total': users.count_documents(RECIPIENTS_QUERY),
+            'owner': OWNER_ID,
+            'lease_until': datetime.utcnow() + timedelta(seconds=LEASE_SECONDS),
+            'sent': 0,
+            'blocked': 0,
+            'unreachable': 0,
+            'failed': 0,
+            'created_by': str(update.effective_user.id),
+            'started_at': datetime.utcnow()
+        }
+        broadcasts.insert_one(job)
+        start_broadcast(context.application, job)
+
+    except Exception as e:
+        logger.error(f"Error in broadcast command: {e}")
+        await update.message.reply_text("❌ An error occurred while starting the broadcast.")
@@ -0,0 +1,352 @@
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Callable, Dict, List, Optional
+
+from bson import json_util
+from bson.json_util import JSONOptions, JSONMode
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from config import Config
+from models import db
+from database import stream_filter
+from user_registry import user_registry
+
+logger = logging.getLogger(__name__)
+
+# Natural key used to upsert each exportable collection
+COLLECTION_KEYS = {
+    'movies': 'stream_id',
+    'users': 'telegram_id'
+}
+
+JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED)
+
+# Telegram Bot API limits for files sent and downloaded by bots
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024
+
+ProgressCallback = Callable[[Dict], None]
+
+
+class CatalogueError(Exception):
+    """Exception for export and import failures."""
+    pass
+
+
+def _checkpoint_path(path: str) -> str:
+    return f"{path}.ckpt"
+
+
+def _read_checkpoint(path: str) -> Optional[Dict]:
+    try:
+        with open(_checkpoint_path(path)) as f:
+            return json_util.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def _write_checkpoint(path: str, state: Dict) -> None:
+    tmp_path = f"{_checkpoint_path(path)}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(json_util.dumps(state, json_options=JSON_OPTIONS))
+    os.replace(tmp_path, _checkpoint_path(path))
+
+
+def _clear_checkpoint(path: str) -> None:
+    try:
+        os.remove(_checkpoint_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def _progress(stats: Dict, started: float, progress: Optional[ProgressCallback]) -> None:
+    elapsed = max(time.monotonic() - started, 1e-6)
+    stats['elapsed'] = elapsed
+    stats['rate'] = stats['session_count'] / elapsed
+    if progress:
+        progress(dict(stats))
+
+
+def _validate_collection(name: str) -> str:
+    if name not in COLLECTION_KEYS:
+        raise CatalogueError(f"Unknown collection '{name}', expected one of {sorted(COLLECTION_KEYS)}")
+    return COLLECTION_KEYS[name]
+
+
+def export_collection(name: str, path: str, chunk_size: int = 1000,
+                      progress: Optional[ProgressCallback] = None) -> Dict:
+    """
+    Stream a collection to gzip-compressed JSONL.
+
+    Documents are read with a cursor in _id order and written one gzip
+    member per chunk, so memory stays bounded by the chunk size and an
+    interrupted export can resume: the file is truncated back to the last
+    checkpointed member and the cursor restarts after the last _id.
+
+    Args:
+        name: Collection name, one of COLLECTION_KEYS
+        path: Output file path
+        chunk_size: Documents per gzip member and checkpoint
+        progress: Optional callback receiving stats after each chunk
+
+    Returns:
+        Stats dict with count, elapsed seconds and rate in documents/second
+    """
+    _validate_collection(name)
+    collection = db[name]
+    checkpoint = _read_checkpoint(path) if os.path.exists(path) else None
+    query = {}
+    if checkpoint:
+        query['_id'] = {'$gt': checkpoint['last_id']}
+        with open(path, 'r+b') as f:
+            f.truncate(checkpoint['offset'])
+        logger.info(f"Resuming export of {name} after {checkpoint['count']} documents")
+    else:
+        _clear_checkpoint(path)
+        open(path, 'wb').close()
+
+    stats = {'collection': name, 'count': checkpoint['count'] if checkpoint else 0, 'session_count': 0}
+    started = time.monotonic()
+    cursor = collection.find(query).sort('_id', 1).batch_size(chunk_size)
+
+    with open(path, 'ab') as raw:
+        chunk: List[str] = []
+
+        def write_chunk() -> None:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as member:
+                member.write(''.join(chunk).encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+            stats['count'] += len(chunk)
+            stats['session_count'] += len(chunk)
+            _write_checkpoint(path, {'last_id': last_id, 'offset': raw.tell(), 'count': stats['count']})
+            chunk.clear()
+            _progress(stats, started, progress)
+
+        try:
+            for doc in cursor:
+                last_id = doc['_id']
+                chunk.append(json_util.dumps(doc, json_options=JSON_OPTIONS) + '\n')
+                if len(chunk) >= chunk_size:
+                    write_chunk()
+            if chunk:
+                write_chunk()
+        finally:
+            cursor.close()
+
+    _clear_checkpoint(path)
+    _progress(stats, started, None)
+    logger.info(f"Exported {stats['count']} {name} documents at {stats['rate']:.0f}/s")
+    return stats
+
+
+def import_collection(name: str, path: str, chunk_size: int = 1000,
+                      progress: Optional[ProgressCallback] = None) -> Dict:
+    """
+    Load a gzip-compressed JSONL dump into a collection.
+
+    Each chunk is applied with one unordered bulk_write of upserts keyed on
+    the collection's natural key, so re-running an import is idempotent.
+    The number of lines consumed is checkpointed after every chunk and an
+    interrupted import skips them when resumed.
+
+    Args:
+        name: Collection name, one of COLLECTION_KEYS
+        path: Dump file path
+        chunk_size: Documents per bulk_write and checkpoint
+        progress: Optional callback receiving stats after each chunk
+
+    Returns:
+        Stats dict with count, upserted, modified, elapsed seconds and rate
+    """
+    key = _validate_collection(name)
+    collection = db[name]
+    checkpoint = _read_checkpoint(path)
+    skip = checkpoint['lines'] if checkpoint else 0
+    if skip:
+        logger.info(f"Resuming import of {name} after line {skip}")
+
+    stats = {
+        'collection': name, 'count': checkpoint['count'] if checkpoint else 0,
+        'session_count': 0, 'upserted': 0, 'modified': 0, 'skipped': 0
+    }
+    started = time.monotonic()
+    operations: List[ReplaceOne] = []
+    stream_ids: List[str] = []
+    consumed = skip
+
+    def apply_chunk() -> None:
+        try:
+            result = collection.bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            # Documents clashing with another unique index (e.g. a duplicate
+            # canonical_url) are skipped; anything else aborts the import
+            result = e.details
+            errors = result.get('writeErrors', [])
+            if any(error.get('code') != 11000 for error in errors):
+                raise
+            stats['skipped'] += len(errors)
+        stats['upserted'] += result.get('nUpserted', 0)
+        stats['modified'] += result.get('nModified', 0)
+        stats['count'] += len(operations)
+        stats['session_count'] += len(operations)
+        for stream_id in stream_ids:
+            stream_filter.add(stream_id)
+        _write_checkpoint(path, {'lines': consumed, 'count': stats['count']})
+        operations.clear()
+        stream_ids.clear()
+        _progress(stats, started, progress)
+
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line_number, line in enumerate(f):
+            if line_number < skip:
+                continue
+            consumed = line_number + 1
+            if not line.strip():
+                continue
+            doc = json_util.loads(line, json_options=JSON_OPTIONS)
+            doc.pop('_id', None)
+            if doc.get(key) is None:
+                stats['skipped'] += 1
+                continue
+            operations.append(ReplaceOne({key: doc[key]}, doc, upsert=True))
+            if name == 'movies':
+                stream_ids.append(doc[key])
+            if len(operations) >= chunk_size:
+                apply_chunk()
+        if operations:
+            apply_chunk()
+
+    _clear_checkpoint(path)
+    _progress(stats, started, None)
+    logger.info(
+        f"Imported {stats['session_count']} {name} documents at {stats['rate']:.0f}/s "
+        f"({stats['upserted']} new, {stats['modified']} updated, {stats['skipped']} skipped)"
+    )
+    return stats
+
+
+def format_progress(action: str, stats: Dict, done: bool = False) -> str:
+    """Status text for admin commands."""
+    return (
+        f"{'✅' if done else '🔄'} {action} {stats['collection']}\n\n"
+        f"📄 Documents: {stats['count']:,}\n"
+        f"⚡️ Speed: {stats.get('rate', 0):,.0f} docs/s\n"
+        f"⏱ Elapsed: {stats.get('elapsed', 0):.1f}s"
+    )
+
+
+async def _run_with_status(update: Update, action: str, func: Callable, *args) -> Dict:
+    """Run a blocking export/import in a thread, editing a status message as it goes."""
+    status_message = await update.message.reply_text(f"🔄 {action} starting...")
+    latest: Dict = {}
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args, progress=latest.update))
+    while not task.done():
+        await asyncio.wait({task}, timeout=5)
+        if latest and not task.done():
+            try:
+                await status_message.edit_text(format_progress(action, latest))
+            except Exception:
+                pass
+    stats = task.result()
+    await status_message.edit_text(format_progress(action, stats, done=True))
+    return stats
+
+
+async def export_command(update: Update, context: CallbackContext) -> None:
+    """Handle /export <collection> for admins."""
+    try:
+        if not user_registry.is_admin(update.effective_user.id):
+            await update.message.reply_text("⚠️ This command is only for admins!")
+            return
+
+        if not context.args or context.args[0] not in COLLECTION_KEYS:
+            await update.message.reply_text(f"📝 Usage: /export {'|'.join(COLLECTION_KEYS)}")
+            return
+
+        name = context.args[0]
+        os.makedirs(Config.EXPORT_DIR, exist_ok=True)
+        path = os.path.join(Config.EXPORT_DIR, f"{name}.jsonl.gz")
+        await _run_with_status(update, "Exporting", export_collection, name, path)
+
+        if os.path.getsize(path) <= MAX_UPLOAD_SIZE:
+            with open(path, 'rb') as f:
+                await update.message.reply_document(f, filename=os.path.basename(path))
+        else:
+            await update.message.reply_text(
+                f"📦 Export is too large to send through Telegram. It was saved on the server at {path}."
+            )
+
+    except Exception as e:
+        logger.error(f"Error in export command: {e}")
+        await update.message.reply_text("❌ An error occurred during export.")
+
+
+async def import_command(update: Update, context: CallbackContext) -> None:
+    """Handle /import <collection> for admins, as a reply to a .jsonl.gz dump."""
+    try:
+        if not user_registry.is_admin(update.effective_user.id):
+            await update.message.reply_text("⚠️ This command is only for admins!")
+            return
+
+        source = update.message.reply_to_message
+        document = source.document if source else None
+        if not context.args or context.args[0] not in COLLECTION_KEYS or not document:
+            await update.message.reply_text(
+                f"📝 Usage: reply to a .jsonl.gz dump with /import {'|'.join(COLLECTION_KEYS)}\n\n"
+                f"Larger dumps can be imported with: python catalogue_io.py import <collection> <file>"
+            )
+            return
+
+        if document.file_size and document.file_size > MAX_DOWNLOAD_SIZE:
+            await update.message.reply_text(
+                "⚠️ Bots can only download files up to 20 MB. Use the command line import instead."
+            )
+            return
+
+        name = context.args[0]
+        os.makedirs(Config.EXPORT_DIR, exist_ok=True)
+        path = os.path.join(Config.EXPORT_DIR, f"import-{document.file_unique_id}.jsonl.gz")
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        await _run_with_status(update, "Importing", import_collection, name, path)
+        os.remove(path)
+
+    except Exception as e:
+        logger.error(f"Error in import command: {e}")
+        await update.message.reply_text("❌ An error occurred during import.")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point for exporting and importing collections."""
+    parser = argparse.ArgumentParser(description="Export or import the bot's catalogue as gzip JSONL.")
+    parser.add_argument('action', choices=('export', 'import'))
+    parser.add_argument('collection', choices=sorted(COLLECTION_KEYS))
+    parser.add_argument('path', help="Dump file, e.g. movies.jsonl.gz")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="Documents per batch and checkpoint")
+    args = parser.parse_args(argv)
+
+    def report(stats: Dict) -> None:
+        print(f"\r{stats['count']:,} documents, {stats['rate']:,.0f}/s", end='', file=sys.stderr)
+
+    func = export_collection if args.action == 'export' else import_collection
+    try:
+        stats = func(args.collection, args.path, chunk_size=args.chunk_size, progress=report)
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume.", file=sys.stderr)
+        return 130
+    print(f"\nDone: {json.dumps({k: v for k, v in stats.items() if k != 'collection'}, default=str)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 import logging
 from typing import List, Optional
@@ -42,6 +43,12 @@ def validate_api_credentials() -> tuple:
         
     return api_id, api_hash
 
+def parse_token_list(tokens_str: Optional[str], name: str) -> List[str]:
+    """Parse a space or comma separated list of bot tokens."""
+    if not tokens_str:
+        return []
+    return [validate_token(token, name) for token in tokens_str.replace(',', ' ').split()]
+
 def parse_admin_list(admins_str: Optional[str]) -> List[int]:
     """Parse admin list from environment variable."""
     if not admins_str:
@@ -57,7 +64,11 @@ class Config:
     
     # Bot Settings
     TELEGRAM_BOT_TOKEN = validate_token(os.getenv('TELEGRAM_BOT_TOKEN'), 'TELEGRAM_BOT_TOKEN')
-    WORKER_BOT_TOKEN = validate_token(os.getenv('WORKER_BOT_TOKEN'), 'WORKER_BOT_TOKEN')
+    # One worker Application runs per token; WORKER_BOT_TOKEN alone is a pool of one
+    WORKER_BOT_TOKENS: List[str] = parse_token_list(os.getenv('WORKER_BOT_TOKENS'), 'WORKER_BOT_TOKENS') or [
+        validate_token(os.getenv('WORKER_BOT_TOKEN'), 'WORKER_BOT_TOKEN')
+    ]
+    WORKER_BOT_TOKEN = WORKER_BOT_TOKENS[0]
     
     # API Settings
     API_ID, API_HASH = validate_api_credentials()
@@ -77,8 +88,13 @@ class Config:
         raise ValueError("MONGODB_URI is not set")
     
     # Performance Settings
-    MAX_CONNECTIONS = int(os.getenv('MAX_CONNECTIONS', '100'))
-    CONNECTION_TIMEOUT = int(os.getenv('CONNECTION_TIMEOUT', '5000'))
+    MONGO_POOL_PROFILE = os.getenv('MONGO_POOL_PROFILE', 'standard').lower()  # small, standard or large
+    MAX_CONNECTIONS = int(os.getenv('MAX_CONNECTIONS', '0'))  # 0 uses the pool profile's size
+    CONNECTION_TIMEOUT = int(os.getenv('CONNECTION_TIMEOUT', '5000'))  # milliseconds
+    MONGO_MAX_STALENESS = max(90, int(os.getenv('MONGO_MAX_STALENESS', '90')))  # seconds, 90 minimum
+    MONGO_COMPRESSORS = [
+        name.strip() for name in os.getenv('MONGO_COMPRESSORS', 'zstd,snappy,zlib').split(',') if name.strip()
+    ]
     
     # Channel and Subscription Settings
     FORCE_SUB_CHANNEL = int(os.getenv('FORCE_SUB_CHANNEL', '0'))
@@ -100,14 +116,41 @@ class Config:
     START_PIC = os.getenv('START_PIC', 'https://graph.org/file/29c1cf05d61f49ed3aa0b.jpg')
     RANDOM_START_PIC = os.getenv('RANDOM_START_PIC', 'True').lower() == 'true'
     
+    # Caption of files uploaded to the storage channel; DELIVERY_CAPTION
+    # is used for movies added by link
     CUSTOM_CAPTION = os.getenv(
         'CUSTOM_CAPTION',
         '{filename}\n\n'
         '💾 Size: {filesize}\n'
         '👤 Shared by: @{username}\n\n'
+        '⚠️ This file will be deleted in {delete_after}!\n'
         '🤖 @YourBotUsername'
     )
     
+    DELIVERY_CAPTION = os.getenv(
+        'DELIVERY_CAPTION',
+        '🎥 {title}\n\n'
+        '⚠️ This file will be deleted in {delete_after}!'
+    )
+    
+    VERIFICATION_MESSAGE = os.getenv(
+        'VERIFICATION_MESSAGE',
+        '✅ URL Verified Successfully!\n\n'
+        '🎥 <b>{title}</b>\n'
+        '📝 {description}\n'
+        '📅 Year: {year}\n'
+        '🎭 Genre: {genre}\n\n'
+        '⚠️ Links expire in {link_ttl}!\n'
+        '⚠️ Files will be automatically deleted after {delete_after}!\n'
+        '⚠️ Forwarding is disabled for security!\n\n'
+        'Choose your preferred option:'
+    )
+    
+    # Parse mode of every message template: HTML, MarkdownV2 or none.
+    # Override it for one template with <TEMPLATE>_PARSE_MODE, e.g.
+    # CUSTOM_CAPTION_PARSE_MODE=MarkdownV2
+    TEMPLATE_PARSE_MODE = os.getenv('TEMPLATE_PARSE_MODE', 'HTML')
+    
     BOT_STATS_TEXT = os.getenv(
         'BOT_STATS_TEXT',
         '📊 <b>Bot Statistics</b>\n\n'
@@ -133,6 +176,12 @@ class Config:
     LOG_CHANNEL = int(os.getenv('LOG_CHANNEL', '0'))
     if LOG_CHANNEL == 0:
         logger.warning("LOG_CHANNEL not set! Logging to channel will be disabled")
+    LOG_CHANNEL_LEVEL = os.getenv('LOG_CHANNEL_LEVEL', 'WARNING').upper()
+    if LOG_CHANNEL_LEVEL not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
+        logger.warning(f"Unknown LOG_CHANNEL_LEVEL {LOG_CHANNEL_LEVEL}, using WARNING")
+        LOG_CHANNEL_LEVEL = 'WARNING'
+    LOG_CHANNEL_FLUSH_INTERVAL = float(os.getenv('LOG_CHANNEL_FLUSH_INTERVAL', '5'))  # seconds
+    LOG_CHANNEL_MAX_PENDING = int(os.getenv('LOG_CHANNEL_MAX_PENDING', '1000'))  # records
     
     # URL Shortener Settings
     GET2SHORT_API_KEY = os.getenv('GET2SHORT_API_KEY', '')
@@ -145,11 +194,72 @@ class Config:
         'audio': ['audio/mpeg', 'audio/mp4', 'audio/ogg'],
         'document': ['application/pdf', 'application/zip', 'application/x-rar-compressed']
     }
+    # Lookup tables built once, so checking an upload is a single hash lookup
+    ALLOWED_MIME_SET = frozenset(mime for types in ALLOWED_MIME_TYPES.values() for mime in types)
+    MIME_FILE_TYPES = {mime: file_type for file_type, types in ALLOWED_MIME_TYPES.items() for mime in types}
+    
+    # Upload Intake Settings
+    UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '3'))
+    UPLOAD_QUEUE_SIZE = int(os.getenv('UPLOAD_QUEUE_SIZE', '100'))
     
     # Cache Settings
     CACHE_TIME = int(os.getenv('CACHE_TIME', '300'))  # 5 minutes default
     CACHE_SIZE = int(os.getenv('CACHE_SIZE', '1000'))
     
+    # User Registry Settings
+    USER_FLUSH_INTERVAL = int(os.getenv('USER_FLUSH_INTERVAL', '10'))  # seconds
+    USER_FLUSH_SIZE = int(os.getenv('USER_FLUSH_SIZE', '500'))
+    USER_ROLES_REFRESH = int(os.getenv('USER_ROLES_REFRESH', '60'))  # seconds
+    
+    # Broadcast Settings
+    BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))  # messages per second
+    BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', '100'))
+    BROADCAST_STATUS_INTERVAL = int(os.getenv('BROADCAST_STATUS_INTERVAL', '5'))  # seconds
+    
+    # Rate Limit Settings
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory').lower()  # memory or mongo
+    RATE_LIMIT_WINDOW = int(os.getenv('RATE_LIMIT_WINDOW', '60'))  # seconds
+    VERIFY_RATE_LIMIT = int(os.getenv('VERIFY_RATE_LIMIT', '5'))  # links per window
+    DELIVERY_RATE_LIMIT = int(os.getenv('DELIVERY_RATE_LIMIT', '3'))  # file sends per window
+    
+    # Expiry Settings
+    ACCESS_TOKEN_TTL = int(os.getenv('ACCESS_TOKEN_TTL', '1800'))  # seconds
+    AUTO_DELETE_DELAY = int(os.getenv('AUTO_DELETE_DELAY', '1800'))  # seconds
+    EXPIRY_SWEEP_INTERVAL = int(os.getenv('EXPIRY_SWEEP_INTERVAL', '30'))  # seconds
+    MOVIE_TTL_DAYS = int(os.getenv('MOVIE_TTL_DAYS', '0'))  # 0 keeps movies forever
+    
+    # Seconds a forwarding restriction is assumed to still be in place
+    FORWARD_RESTRICT_TTL = int(os.getenv('FORWARD_RESTRICT_TTL', '3600'))
+    
+    # Worker Pool Settings
+    WORKER_HEARTBEAT_INTERVAL = int(os.getenv('WORKER_HEARTBEAT_INTERVAL', '15'))  # seconds
+    WORKER_LOAD_SLACK = int(os.getenv('WORKER_LOAD_SLACK', '5'))  # in-flight sends before rebalancing
+    
+    # Popularity Settings
+    POPULARITY_HALF_LIFE = float(os.getenv('POPULARITY_HALF_LIFE', '24'))  # hours
+    POPULARITY_PERSIST_INTERVAL = int(os.getenv('POPULARITY_PERSIST_INTERVAL', '60'))  # seconds
+    POPULARITY_TOP_SIZE = int(os.getenv('POPULARITY_TOP_SIZE', '50'))
+    POPULARITY_PREWARM = int(os.getenv('POPULARITY_PREWARM', '100'))  # movies warmed at startup
+    
+    # Cache Coherence Settings (MongoDB change streams, needs a replica set)
+    CHANGE_STREAMS_ENABLED = os.getenv('CHANGE_STREAMS_ENABLED', 'True').lower() == 'true'
+    # Identifies this process's resume token; Heroku sets DYNO (e.g. web.1)
+    INSTANCE_NAME = os.getenv('INSTANCE_NAME') or os.getenv('DYNO') or socket.gethostname()
+    # Movie cache lifetime while change streams keep it coherent
+    COHERENT_CACHE_TIME = int(os.getenv('COHERENT_CACHE_TIME', '3600'))  # seconds
+    
+    # Seconds to wait for in-flight handlers on shutdown (Heroku kills after 30)
+    SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '20'))
+    
+    # Directory for catalogue exports and uploaded import dumps
+    EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+    
+    # Stream ID Filter Settings
+    STREAM_FILTER_PATH = os.getenv('STREAM_FILTER_PATH', 'stream_ids.bloom')
+    STREAM_FILTER_CAPACITY = int(os.getenv('STREAM_FILTER_CAPACITY', '1000000'))
+    STREAM_FILTER_ERROR_RATE = float(os.getenv('STREAM_FILTER_ERROR_RATE', '0.001'))
+    STREAM_FILTER_REFRESH = int(os.getenv('STREAM_FILTER_REFRESH', '30'))  # seconds
+    
     @classmethod
     def get_allowed_mime_types(cls) -> List[str]:
         """Get flat list of all allowed MIME types."""
@@ -158,12 +268,15 @@ class Config:
     @classmethod
     def is_mime_type_allowed(cls, mime_type: str) -> bool:
         """Check if a MIME type is allowed."""
-        return mime_type in cls.get_allowed_mime_types()
+        return mime_type in cls.ALLOWED_MIME_SET
     
     @classmethod
     def get_file_type(cls, mime_type: str) -> Optional[str]:
         """Get file type category from MIME type."""
-        for file_type, mime_types in cls.ALLOWED_MIME_TYPES.items():
-            if mime_type in mime_types:
-                return file_type
-        return None
\ No newline at end of file
+        return cls.MIME_FILE_TYPES.get(mime_type)
+    
+    @classmethod
+    def template_parse_mode(cls, name: str) -> Optional[str]:
+        """Parse mode for a message template; 'none' sends it as plain text."""
+        parse_mode = os.getenv(f'{name}_PARSE_MODE', cls.TEMPLATE_PARSE_MODE)
+        return None if parse_mode.lower() == 'none' else parse_mode
\ No newline at end of file
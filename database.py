@@ -1,8 +1,15 @@
 from typing import Optional, Dict, Any, List
 import logging
-from datetime import datetime
-from models import db, movies, users, statistics
+import secrets
+from datetime import datetime, timedelta
+from models import db, movies, movies_secondary, users, statistics, access_tokens, deliveries
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from config import Config
+from dedupe import canonicalize_url
+from stream_filter import StreamIdFilter
+from movie_cache import MovieCache
 
 logger = logging.getLogger(__name__)
 
@@ -14,10 +21,38 @@ class DatabaseError(Exception):
     """Base exception for database operations."""
     pass
 
+class DuplicateMovieError(DatabaseError):
+    """Raised when a movie with the same canonical URL or fingerprint exists."""
+    def __init__(self, existing: Dict):
+        super().__init__("Movie already exists")
+        self.existing = existing
+
+stream_filter = StreamIdFilter(
+    path=Config.STREAM_FILTER_PATH,
+    capacity=Config.STREAM_FILTER_CAPACITY,
+    error_rate=Config.STREAM_FILTER_ERROR_RATE,
+    refresh_interval=Config.STREAM_FILTER_REFRESH
+)
+
+movie_cache = MovieCache(max_size=Config.CACHE_SIZE, ttl=Config.CACHE_TIME)
+
 def get_db():
     """Get database connection."""
     return db
 
+def is_expired(document: Dict) -> bool:
+    """Check expires_at directly, since the TTL monitor only runs once a minute."""
+    expires_at = document.get("expires_at")
+    return expires_at is not None and expires_at <= datetime.utcnow()
+
+def load_stream_filter() -> None:
+    """Build or restore the stream ID filter so the first lookup is fast."""
+    try:
+        stream_filter.load(movies)
+    except Exception as e:
+        logger.error(f"Error loading stream ID filter: {e}")
+        raise DatabaseError("Error loading stream ID filter") from e
+
 def verify_url_token(url: str) -> Optional[Dict[str, Any]]:
     """
     Verify shortened URL and return stream_id if valid.
@@ -37,9 +72,12 @@ def verify_url_token(url: str) -> Optional[Dict[str, Any]]:
             return None
 
         stream_id = url.split('/')[-1]
-        movie = movies.find_one({"stream_id": stream_id})
+        if not stream_id or not stream_filter.might_contain(stream_id, movies):
+            return None
 
-        if not movie:
+        movie = movies.find_one({"stream_id": stream_id}, {"_id": 1, "expires_at": 1})
+
+        if not movie or is_expired(movie):
             return None
 
         return {
@@ -62,11 +100,42 @@ def get_movie_by_stream_id(stream_id: str) -> Optional[Dict]:
         Movie document or None if not found
     """
     try:
-        return movies.find_one({"stream_id": stream_id})
+        movie = movie_cache.get(stream_id)
+        if movie is None:
+            movie = movies.find_one({"stream_id": stream_id})
+            if movie:
+                movie_cache.put(movie)
+        if movie and is_expired(movie):
+            return None
+        return movie
     except Exception as e:
         logger.error(f"Error getting movie with stream_id {stream_id}: {e}")
         raise DatabaseError("Error retrieving movie") from e
 
+def get_movies_by_stream_ids(stream_ids: List[str]) -> List[Dict]:
+    """
+    Get several movies by stream ID with one query for the ones not cached.
+    
+    Args:
+        stream_ids: Stream IDs to look up
+        
+    Returns:
+        Movie documents that exist and have not expired, in the given order
+    """
+    try:
+        found, missing = movie_cache.get_many(stream_ids)
+        if missing:
+            for movie in movies.find({"stream_id": {"$in": missing}}):
+                movie_cache.put(movie)
+                found[movie["stream_id"]] = movie
+        return [
+            found[stream_id] for stream_id in stream_ids
+            if stream_id in found and not is_expired(found[stream_id])
+        ]
+    except Exception as e:
+        logger.error(f"Error getting {len(stream_ids)} movies by stream_id: {e}")
+        raise DatabaseError("Error retrieving movies") from e
+
 def search_movies(query: str, limit: int = 10) -> List[Dict]:
     """
     Search movies by title.
@@ -79,7 +148,7 @@ def search_movies(query: str, limit: int = 10) -> List[Dict]:
         List of matching movie documents
     """
     try:
-        return list(movies.find(
+        return list(movies_secondary.find(
             {"title": {"$regex": query, "$options": "i"}},
             limit=limit
         ).sort("created_at", -1))
@@ -87,12 +156,13 @@ def search_movies(query: str, limit: int = 10) -> List[Dict]:
         logger.error(f"Error searching movies with query '{query}': {e}")
         raise DatabaseError("Error searching movies") from e
 
-def increment_movie_views(stream_id: str) -> bool:
+def increment_movie_views(stream_id: str, count: int = 1) -> bool:
     """
     Increment movie view count.
     
     Args:
         stream_id: The stream ID of the movie
+        count: Number of views to add
         
     Returns:
         True if successful, False otherwise
@@ -100,16 +170,87 @@ def increment_movie_views(stream_id: str) -> bool:
     try:
         result = movies.update_one(
             {"stream_id": stream_id},
-            {"$inc": {"views": 1}}
+            {"$inc": {"views": count}}
         )
         return result.modified_count > 0
     except Exception as e:
         logger.error(f"Error incrementing views for stream_id {stream_id}: {e}")
         raise DatabaseError("Error updating view count") from e
 
+def bulk_increment_movie_views(counts: Dict[str, int]) -> int:
+    """
+    Add buffered view counts to several movies in one round trip.
+    
+    Args:
+        counts: Views to add by stream_id
+        
+    Returns:
+        Number of movies updated
+    """
+    if not counts:
+        return 0
+    try:
+        result = movies.bulk_write(
+            [UpdateOne({"stream_id": stream_id}, {"$inc": {"views": count}})
+             for stream_id, count in counts.items()],
+            ordered=False
+        )
+        return result.modified_count
+    except Exception as e:
+        logger.error(f"Error incrementing views for {len(counts)} movies: {e}")
+        raise DatabaseError("Error updating view counts") from e
+
+def build_movie_document(title: str, stream_id: str, file_url: str,
+                         description: Optional[str] = None, year: Optional[int] = None,
+                         genre: Optional[str] = None, uploader_id: Optional[str] = None,
+                         expires_at: Optional[datetime] = None,
+                         fingerprint: Optional[str] = None,
+                         file_info: Optional[Dict] = None) -> Dict:
+    """Build a movie document with its canonical URL and default expiry."""
+    movie = {
+        "title": title,
+        "stream_id": stream_id,
+        "file_url": file_url,
+        "canonical_url": canonicalize_url(file_url),
+        "description": description,
+        "year": year,
+        "genre": genre,
+        "uploader_id": uploader_id,
+        "views": 0,
+        "created_at": datetime.utcnow()
+    }
+    if fingerprint:
+        movie["fingerprint"] = fingerprint
+    if file_info:
+        movie.update(file_info)
+    if expires_at is None and Config.MOVIE_TTL_DAYS > 0:
+        expires_at = movie["created_at"] + timedelta(days=Config.MOVIE_TTL_DAYS)
+    if expires_at is not None:
+        movie["expires_at"] = expires_at
+    return movie
+
+def find_duplicate_movie(canonical_url: str, fingerprint: Optional[str] = None) -> Optional[Dict]:
+    """
+    Find an existing movie with the same canonical URL or content fingerprint.
+    
+    Args:
+        canonical_url: Canonical form of the file URL
+        fingerprint: Optional content fingerprint
+        
+    Returns:
+        Existing movie document or None
+    """
+    conditions = [{"canonical_url": canonical_url}]
+    if fingerprint:
+        conditions.append({"fingerprint": fingerprint})
+    return movies.find_one({"$or": conditions})
+
 def create_movie(title: str, stream_id: str, file_url: str, 
                 description: Optional[str] = None, year: Optional[int] = None,
-                genre: Optional[str] = None, uploader_id: Optional[str] = None) -> Dict:
+                genre: Optional[str] = None, uploader_id: Optional[str] = None,
+                expires_at: Optional[datetime] = None,
+                fingerprint: Optional[str] = None,
+                file_info: Optional[Dict] = None) -> Dict:
     """
     Create a new movie entry.
     
@@ -121,36 +262,204 @@ def create_movie(title: str, stream_id: str, file_url: str,
         year: Optional release year
         genre: Optional movie genre
         uploader_id: Optional uploader's ID
+        expires_at: Optional expiry time, defaults to MOVIE_TTL_DAYS from now
+        fingerprint: Optional content fingerprint from the dedupe module
+        file_info: Optional Telegram file details (file_id, file_name,
+            file_size, mime_type and the storage channel message)
         
     Returns:
         Created movie document
         
     Raises:
+        DuplicateMovieError: If the same file is already stored
         DatabaseError: If creation fails
     """
     try:
-        movie = {
-            "title": title,
-            "stream_id": stream_id,
-            "file_url": file_url,
-            "description": description,
-            "year": year,
-            "genre": genre,
-            "uploader_id": uploader_id,
-            "views": 0,
-            "created_at": datetime.utcnow()
-        }
+        movie = build_movie_document(
+            title, stream_id, file_url, description, year, genre,
+            uploader_id, expires_at, fingerprint, file_info
+        )
         
+        # The unique indexes on canonical_url and fingerprint reject duplicates
         result = movies.insert_one(movie)
         if not result.inserted_id:
             raise DatabaseError("Failed to insert movie")
+        
+        stream_filter.add(stream_id)
             
         return movie
         
+    except DuplicateKeyError as e:
+        existing = find_duplicate_movie(movie["canonical_url"], fingerprint)
+        if not existing:
+            logger.error(f"Error creating movie {title}: stream_id {stream_id} already exists")
+            raise DatabaseError("Error creating movie") from e
+        raise DuplicateMovieError(existing) from e
     except Exception as e:
         logger.error(f"Error creating movie {title}: {e}")
         raise DatabaseError("Error creating movie") from e
 
+def set_movie_links(stream_id: str, links: Dict[str, str]) -> None:
+    """
+    Store shortened links on a movie.
+    
+    Args:
+        stream_id: The stream ID of the movie
+        links: Movie fields such as short_url_get2short mapped to links
+    """
+    if not links:
+        return
+    try:
+        movies.update_one(
+            {"stream_id": stream_id},
+            {"$set": dict(links, updated_at=datetime.utcnow())}
+        )
+        movie_cache.invalidate(stream_id)
+    except Exception as e:
+        logger.error(f"Error storing links for stream_id {stream_id}: {e}")
+        raise DatabaseError("Error storing movie links") from e
+
+def bulk_create_movies(entries: List[Dict], uploader_id: Optional[str] = None) -> Dict[str, List[Dict]]:
+    """
+    Create many movies at once, collapsing duplicates.
+    
+    Duplicates inside the batch are collapsed in memory by canonical URL;
+    duplicates of stored movies are collapsed by the database through
+    upserts keyed on canonical_url, so no per-item lookup is made. An
+    upsert rejected by the fingerprint index is resolved to the movie
+    holding that fingerprint.
+    
+    Args:
+        entries: Dicts with title, file_url, stream_id and optional
+            description, year, genre and fingerprint
+        uploader_id: Optional uploader's ID
+        
+    Returns:
+        Dict with 'created', 'duplicates' and 'failed' lists of
+        {'title', 'stream_id'} entries, in input order
+    """
+    try:
+        documents: Dict[str, Dict] = {}
+        order = []
+        for entry in entries:
+            document = build_movie_document(
+                entry["title"], entry["stream_id"], entry["file_url"],
+                entry.get("description"), entry.get("year"), entry.get("genre"),
+                uploader_id, fingerprint=entry.get("fingerprint")
+            )
+            order.append((entry["title"], document["canonical_url"]))
+            documents.setdefault(document["canonical_url"], document)
+        
+        canonical_urls = list(documents)
+        operations = [
+            UpdateOne({"canonical_url": url}, {"$setOnInsert": documents[url]}, upsert=True)
+            for url in canonical_urls
+        ]
+        created_urls = set()
+        if operations:
+            try:
+                result = movies.bulk_write(operations, ordered=False)
+                upserted = result.upserted_ids
+            except BulkWriteError as e:
+                # Fingerprint or concurrent-insert collisions; the rest still applied
+                upserted = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+                other = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                if other:
+                    raise
+            created_urls = {canonical_urls[index] for index in upserted}
+        
+        stored = {
+            doc["canonical_url"]: doc["stream_id"]
+            for doc in movies.find({"canonical_url": {"$in": canonical_urls}}, {"canonical_url": 1, "stream_id": 1})
+        }
+        # Upserts rejected by the fingerprint index: the same file under another URL
+        fingerprints: Dict[str, List[str]] = {}
+        for url in canonical_urls:
+            if url not in stored and documents[url].get("fingerprint"):
+                fingerprints.setdefault(documents[url]["fingerprint"], []).append(url)
+        if fingerprints:
+            for doc in movies.find({"fingerprint": {"$in": list(fingerprints)}}, {"fingerprint": 1, "stream_id": 1}):
+                for url in fingerprints[doc["fingerprint"]]:
+                    stored[url] = doc["stream_id"]
+        for url in created_urls:
+            stream_filter.add(documents[url]["stream_id"])
+        
+        results: Dict[str, List[Dict]] = {"created": [], "duplicates": [], "failed": []}
+        seen = set()
+        for title, url in order:
+            if url not in stored:
+                results["failed"].append({"title": title, "stream_id": None})
+                continue
+            new = url in created_urls and url not in seen
+            seen.add(url)
+            results["created" if new else "duplicates"].append({
+                "title": title,
+                "stream_id": stored[url]
+            })
+        return results
+        
+    except Exception as e:
+        logger.error(f"Error bulk creating {len(entries)} movies: {e}")
+        raise DatabaseError("Error creating movies") from e
+
+def backfill_canonical_urls(chunk_size: int = 1000) -> Dict[str, Any]:
+    """
+    Give movies stored before deduplication a canonical_url.
+
+    Movies are visited oldest first, so when several share a canonical URL
+    the oldest one keeps it. The others are rejected by the unique index,
+    left without a canonical_url and reported for review; nothing is
+    deleted. Safe to run again after an interruption.
+    
+    Args:
+        chunk_size: Movies updated per bulk write
+        
+    Returns:
+        Dict with the 'updated' count and a 'duplicates' list of
+        {'stream_id', 'title', 'duplicate_of'} entries
+    """
+    stats: Dict[str, Any] = {"updated": 0, "duplicates": []}
+    last_id = None
+    try:
+        while True:
+            query: Dict[str, Any] = {"canonical_url": {"$exists": False}, "file_url": {"$type": "string"}}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            docs = list(movies.find(query, {"file_url": 1, "stream_id": 1, "title": 1})
+                        .sort("_id", 1).limit(chunk_size))
+            if not docs:
+                return stats
+            last_id = docs[-1]["_id"]
+            canonical = [canonicalize_url(doc["file_url"]) for doc in docs]
+            operations = [
+                UpdateOne({"_id": doc["_id"], "canonical_url": {"$exists": False}}, {"$set": {"canonical_url": url}})
+                for doc, url in zip(docs, canonical)
+            ]
+            try:
+                stats["updated"] += movies.bulk_write(operations, ordered=False).modified_count
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in errors):
+                    raise
+                stats["updated"] += e.details.get("nModified", 0)
+                rejected = [error["index"] for error in errors]
+                holders = {
+                    doc["canonical_url"]: doc["stream_id"]
+                    for doc in movies.find(
+                        {"canonical_url": {"$in": [canonical[index] for index in rejected]}},
+                        {"canonical_url": 1, "stream_id": 1}
+                    )
+                }
+                for index in rejected:
+                    stats["duplicates"].append({
+                        "stream_id": docs[index].get("stream_id"),
+                        "title": docs[index].get("title"),
+                        "duplicate_of": holders.get(canonical[index])
+                    })
+    except Exception as e:
+        logger.error(f"Error backfilling canonical URLs: {e}")
+        raise DatabaseError("Error backfilling canonical URLs") from e
+
 def get_movie_stats() -> Dict[str, Any]:
     """
     Get movie statistics.
@@ -159,14 +468,152 @@ def get_movie_stats() -> Dict[str, Any]:
         Dictionary containing total movies, views, and other stats
     """
     try:
-        total_movies = movies.count_documents({})
-        total_views = sum(movie.get('views', 0) for movie in movies.find({}, {'views': 1}))
+        totals = next(movies_secondary.aggregate([
+            {"$group": {
+                "_id": None,
+                "total_movies": {"$sum": 1},
+                "total_views": {"$sum": {"$ifNull": ["$views", 0]}},
+                "total_size": {"$sum": {"$ifNull": ["$file_size", 0]}}
+            }}
+        ]), {})
         
         return {
-            'total_movies': total_movies,
-            'total_views': total_views,
+            'total_movies': totals.get('total_movies', 0),
+            'total_views': totals.get('total_views', 0),
+            'total_size': totals.get('total_size', 0),
             'last_updated': datetime.utcnow()
         }
     except Exception as e:
         logger.error(f"Error getting movie stats: {e}")
-        raise DatabaseError("Error retrieving movie statistics") from e
\ No newline at end of file
+        raise DatabaseError("Error retrieving movie statistics") from e
+
+def create_access_token(user_id: int, stream_id: str, ttl: int) -> str:
+    """
+    Create a short-lived access token for a verified user.
+    
+    Args:
+        user_id: Telegram ID of the verified user
+        stream_id: The stream ID the token grants access to
+        ttl: Lifetime in seconds; the TTL index removes the token afterwards
+        
+    Returns:
+        The token string
+    """
+    try:
+        token = secrets.token_urlsafe(32)
+        access_tokens.insert_one({
+            "token": token,
+            "user_id": user_id,
+            "stream_id": stream_id,
+            "expires_at": datetime.utcnow() + timedelta(seconds=ttl)
+        })
+        return token
+    except Exception as e:
+        logger.error(f"Error creating access token for user {user_id}: {e}")
+        raise DatabaseError("Error creating access token") from e
+
+def get_access_token(token: str) -> Optional[Dict]:
+    """
+    Get an unexpired access token.
+    
+    Args:
+        token: The token string
+        
+    Returns:
+        Token document or None if unknown or expired
+    """
+    try:
+        return access_tokens.find_one({"token": token, "expires_at": {"$gt": datetime.utcnow()}})
+    except Exception as e:
+        logger.error(f"Error getting access token: {e}")
+        raise DatabaseError("Error retrieving access token") from e
+
+def record_delivery(bot_id: int, chat_id: int, message_id: int, delay: int, notify: bool = True) -> None:
+    """
+    Record a sent message for deletion after a delay.
+    
+    Args:
+        bot_id: ID of the bot that sent the message and must delete it
+        chat_id: Chat the message was sent to
+        message_id: ID of the message
+        delay: Seconds until the message should be deleted
+        notify: Whether to tell the user the message was deleted
+    """
+    try:
+        delete_at = datetime.utcnow() + timedelta(seconds=delay)
+        deliveries.insert_one({
+            "bot_id": bot_id,
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "notify": notify,
+            "delete_at": delete_at,
+            # Backstop in case the sweeper never gets to it
+            "purge_at": delete_at + timedelta(days=2)
+        })
+    except Exception as e:
+        logger.error(f"Error recording delivery {chat_id}/{message_id}: {e}")
+        raise DatabaseError("Error recording delivery") from e
+
+def claim_due_deliveries(bot_id: int, claim_id: str, limit: int = 500) -> List[Dict]:
+    """
+    Claim deliveries that are due for deletion so only one process handles them.
+    
+    Args:
+        bot_id: Only deliveries sent by this bot are claimed
+        claim_id: Unique ID of this sweep
+        limit: Maximum number of deliveries to return
+        
+    Returns:
+        List of claimed delivery documents
+    """
+    try:
+        now = datetime.utcnow()
+        due = list(deliveries.find(
+            {
+                "bot_id": bot_id,
+                "delete_at": {"$lte": now},
+                "$or": [
+                    {"claimed_at": {"$exists": False}},
+                    {"claimed_at": {"$lt": now - timedelta(minutes=5)}}
+                ]
+            },
+            {"_id": 1},
+            limit=limit
+        ).sort("delete_at", 1))
+        if not due:
+            return []
+        deliveries.update_many(
+            {
+                "_id": {"$in": [doc["_id"] for doc in due]},
+                "$or": [
+                    {"claimed_at": {"$exists": False}},
+                    {"claimed_at": {"$lt": now - timedelta(minutes=5)}}
+                ]
+            },
+            {"$set": {"claimed_by": claim_id, "claimed_at": now}}
+        )
+        return list(deliveries.find({"claimed_by": claim_id}))
+    except Exception as e:
+        logger.error(f"Error claiming due deliveries: {e}")
+        raise DatabaseError("Error claiming deliveries") from e
+
+def release_deliveries(delivery_ids: List[ObjectId]) -> None:
+    """Give claimed deliveries back so the next sweep can pick them up at once."""
+    try:
+        if delivery_ids:
+            deliveries.update_many(
+                {"_id": {"$in": delivery_ids}},
+                {"$unset": {"claimed_by": "", "claimed_at": ""}}
+            )
+    except Exception as e:
+        logger.error(f"Error releasing deliveries: {e}")
+        raise DatabaseError("Error releasing deliveries") from e
+
+def remove_deliveries(delivery_ids: List[ObjectId]) -> None:
+    """Remove handled delivery records."""
+    try:
+        if delivery_ids:
+            deliveries.delete_many({"_id": {"$in": delivery_ids}})
+    except Exception as e:
+        logger.error(f"Error removing deliveries: {e}")
+        raise DatabaseError("Error removing deliveries") from e
\ No newline at end of file
@@ -0,0 +1,182 @@
+import re
+import sys
+import asyncio
+import hashlib
+import logging
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that never change which file a URL points to
+TRACKING_PARAMS = frozenset({
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'igshid', 'mc_cid', 'mc_eid', 'ref', 'ref_src', 'usp'
+})
+
+_GDRIVE_HOSTS = frozenset({'drive.google.com', 'docs.google.com', 'drive.usercontent.google.com'})
+_GDRIVE_PATH_ID = re.compile(r'/(?:file/)?d/([A-Za-z0-9_-]{10,})')
+_MEGA_HOSTS = frozenset({'mega.nz', 'mega.co.nz'})
+_MEGA_PATH_ID = re.compile(r'^/(?:file|folder)/([A-Za-z0-9_-]+)')
+_MEGA_LEGACY_ID = re.compile(r'^F?!([A-Za-z0-9_-]+)')
+
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 3
+FINGERPRINT_CONCURRENCY = 4
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Reduce a file URL to a canonical form so that different spellings of the
+    same link compare equal.
+
+    Google Drive and Mega links collapse to 'gdrive:<id>' and 'mega:<id>'.
+    Other URLs get a lowercase host without 'www.' or a default port, a
+    normalized path, tracking parameters removed, query parameters sorted
+    and the fragment dropped. http and https are treated as the same.
+
+    Args:
+        url: The URL to canonicalize
+
+    Returns:
+        Canonical URL string
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = parse_qsl(parts.query, keep_blank_values=True)
+
+    if host in _GDRIVE_HOSTS:
+        match = _GDRIVE_PATH_ID.search(parts.path)
+        file_id = match.group(1) if match else dict(query).get('id')
+        if file_id:
+            return f"gdrive:{file_id}"
+
+    if host in _MEGA_HOSTS:
+        match = _MEGA_PATH_ID.match(parts.path) or _MEGA_LEGACY_ID.match(parts.fragment)
+        if match:
+            return f"mega:{match.group(1)}"
+
+    scheme = parts.scheme.lower()
+    if scheme == 'http':
+        scheme = 'https'
+    port = parts.port
+    netloc = host if port in (None, 80, 443) else f"{host}:{port}"
+
+    path = re.sub(r'/{2,}', '/', quote(unquote(parts.path), safe="/:@!$&'()*+,;=-._~"))
+    if len(path) > 1:
+        path = path.rstrip('/')
+
+    query = sorted(
+        (key, value) for key, value in query
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith('utm_')
+    )
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+
+def stream_id_for(canonical_url: str) -> str:
+    """Deterministic stream ID for a canonical URL."""
+    return hashlib.sha256(canonical_url.encode('utf-8')).hexdigest()[:16]
+
+
+def telegram_fingerprint(file_unique_id: str) -> str:
+    """Fingerprint for a Telegram file. file_unique_id is the same for every bot."""
+    return f"tg:{file_unique_id}"
+
+
+def _sample_ranges(length: int) -> List[Tuple[int, int]]:
+    """Byte ranges sampled from the start, middle and end of a file."""
+    if length <= SAMPLE_SIZE * SAMPLE_COUNT:
+        return [(0, length - 1)]
+    step = (length - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+    return [(i * step, i * step + SAMPLE_SIZE - 1) for i in range(SAMPLE_COUNT)]
+
+
+async def fingerprint_url(url: str, session: Optional[aiohttp.ClientSession] = None,
+                          timeout: int = 15) -> Optional[str]:
+    """
+    Cheap content fingerprint from the file length and a few sampled chunks.
+
+    Uses HTTP range requests, so at most SAMPLE_COUNT * SAMPLE_SIZE bytes are
+    downloaded regardless of file size. Returns None when the server doesn't
+    report a length or doesn't honour range requests.
+
+    Args:
+        url: Direct URL of the file
+        session: Optional session to reuse
+        timeout: Total timeout in seconds
+
+    Returns:
+        Fingerprint string '<length>:<hash>' or None
+    """
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout))
+    try:
+        async with session.get(url, headers={'Range': 'bytes=0-0'}) as response:
+            content_range = response.headers.get('Content-Range', '')
+            if response.status != 206 or '/' not in content_range:
+                return None
+            total = content_range.rsplit('/', 1)[1]
+            if not total.isdigit() or int(total) == 0:
+                return None
+            length = int(total)
+
+        digest = hashlib.sha256(str(length).encode('ascii'))
+        for start, end in _sample_ranges(length):
+            async with session.get(url, headers={'Range': f"bytes={start}-{end}"}) as response:
+                if response.status != 206:
+                    return None
+                digest.update(await response.content.readexactly(end - start + 1))
+        return f"{length}:{digest.hexdigest()[:32]}"
+    except (aiohttp.ClientError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        logger.warning(f"Could not fingerprint {url}: {e}")
+        return None
+    finally:
+        if own_session:
+            await session.close()
+
+
+async def fingerprint_urls(urls: List[str], concurrency: int = FINGERPRINT_CONCURRENCY,
+                           timeout: int = 15) -> List[Optional[str]]:
+    """
+    Fingerprint several files over one session, at most `concurrency` at a time.
+
+    Google Drive and Mega links serve a web page rather than the file, so
+    they are not fingerprinted.
+
+    Returns:
+        Fingerprints or None, in the order of `urls`
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fingerprint(url: str) -> Optional[str]:
+        host = (urlsplit(url).hostname or '').lower()
+        if host in _GDRIVE_HOSTS or host in _MEGA_HOSTS:
+            return None
+        async with semaphore:
+            return await fingerprint_url(url, session)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        return await asyncio.gather(*(fingerprint(url) for url in urls))
+
+
+def main() -> int:
+    """Command line entry point: give movies stored before deduplication a canonical URL."""
+    # Imported here: database depends on this module
+    from database import backfill_canonical_urls
+
+    stats = backfill_canonical_urls()
+    print(f"Added canonical URLs to {stats['updated']:,} movies", file=sys.stderr)
+    for duplicate in stats['duplicates']:
+        print(
+            f"Duplicate: {duplicate['stream_id']} ({duplicate['title']}) "
+            f"is the same file as {duplicate['duplicate_of']}"
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import secrets
+from typing import Dict, List
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import Application, CallbackContext
+
+from config import Config
+from database import claim_due_deliveries, record_delivery, release_deliveries, remove_deliveries
+
+logger = logging.getLogger(__name__)
+
+DELETION_NOTICE = "⚠️ File has been automatically deleted for security reasons."
+NOTICE_LIFETIME = 10  # seconds
+
+
+def schedule_deletion(bot_id: int, chat_id: int, message_id: int,
+                      delay: int = Config.AUTO_DELETE_DELAY, notify: bool = True) -> None:
+    """
+    Persist a message for deletion by the sweeper.
+
+    Nothing is held in process memory, so pending deletions survive restarts
+    and are handled by whichever worker process for the same bot sweeps first.
+    """
+    try:
+        record_delivery(bot_id, chat_id, message_id, delay, notify)
+    except Exception as e:
+        logger.error(f"Error scheduling deletion of {chat_id}/{message_id}: {e}")
+
+
+async def _delete_one(application: Application, delivery: Dict) -> bool:
+    """Delete one message. Returns False if it should be retried later."""
+    bot = application.bot
+    try:
+        await bot.delete_message(chat_id=delivery['chat_id'], message_id=delivery['message_id'])
+    except RetryAfter:
+        return False
+    except TelegramError as e:
+        # Already deleted by the user or too old to delete: nothing left to do
+        logger.debug(f"Could not delete {delivery['chat_id']}/{delivery['message_id']}: {e}")
+        return True
+
+    if delivery.get('notify'):
+        try:
+            notice = await bot.send_message(chat_id=delivery['chat_id'], text=DELETION_NOTICE)
+            schedule_deletion(bot.id, notice.chat_id, notice.message_id, NOTICE_LIFETIME, notify=False)
+        except TelegramError as e:
+            logger.debug(f"Could not send deletion notice to {delivery['chat_id']}: {e}")
+    return True
+
+
+async def sweep_expired(context: CallbackContext) -> None:
+    """Delete every due message for this bot in one concurrent batch."""
+    try:
+        application = context.application
+        due: List[Dict] = claim_due_deliveries(application.bot.id, secrets.token_hex(8))
+        if not due:
+            return
+        results = await asyncio.gather(*(_delete_one(application, delivery) for delivery in due))
+        done = [delivery['_id'] for delivery, ok in zip(due, results) if ok]
+        deferred = [delivery['_id'] for delivery, ok in zip(due, results) if not ok]
+        remove_deliveries(done)
+        if deferred:
+            # Unclaimed, so they are retried on the next sweep instead of after the claim times out
+            release_deliveries(deferred)
+            logger.warning(f"Rate limited while deleting, {len(deferred)} deletions deferred")
+    except Exception as e:
+        logger.error(f"Error sweeping expired deliveries: {e}")
+
+
+def register_expiry_sweeper(application: Application) -> None:
+    """Run the deletion sweeper periodically on the application's job queue."""
+    application.job_queue.run_repeating(sweep_expired, interval=Config.EXPIRY_SWEEP_INTERVAL, first=5)
@@ -0,0 +1,70 @@
+import time
+import logging
+from typing import Dict, Tuple
+
+from telegram import Chat, ChatPermissions
+from telegram.ext import Application
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# restrict_chat_member only works in supergroups. In private chats and
+# basic groups protect_content on the sent file is the only protection.
+RESTRICTABLE_CHAT_TYPES = frozenset({Chat.SUPERGROUP})
+
+FORWARD_PERMISSIONS = ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True,
+    can_send_polls=True,
+    can_change_info=False,
+    can_invite_users=True,
+    can_pin_messages=False
+)
+
+
+class ForwardingPolicy:
+    """
+    Decides whether a delivery needs restrict_chat_member and remembers
+    which (chat, user) pairs already have the restriction applied.
+
+    Restrictions run as background tasks so they never delay the file send;
+    the file itself is always sent with protect_content.
+    """
+
+    def __init__(self, ttl: int, max_entries: int = 50000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._applied: Dict[Tuple[int, int], float] = {}
+
+    def needs_restriction(self, chat: Chat, user_id: int) -> bool:
+        """Whether restriction applies to this chat and hasn't been applied recently."""
+        if chat.type not in RESTRICTABLE_CHAT_TYPES:
+            return False
+        return self._applied.get((chat.id, user_id), 0.0) <= time.monotonic()
+
+    def protect(self, application: Application, chat: Chat, user_id: int) -> None:
+        """Apply the forwarding restriction in the background if it is needed."""
+        if not self.needs_restriction(chat, user_id):
+            return
+        # Mark before the call so concurrent deliveries don't repeat it
+        self._mark(chat.id, user_id)
+        application.create_task(self._restrict(application, chat.id, user_id))
+
+    async def _restrict(self, application: Application, chat_id: int, user_id: int) -> None:
+        try:
+            await application.bot.restrict_chat_member(chat_id, user_id, FORWARD_PERMISSIONS)
+        except Exception as e:
+            self._applied.pop((chat_id, user_id), None)
+            logger.error(f"Error restricting user forwarding: {e}")
+
+    def _mark(self, chat_id: int, user_id: int) -> None:
+        now = time.monotonic()
+        if len(self._applied) >= self.max_entries:
+            self._applied = {key: expires for key, expires in self._applied.items() if expires > now}
+        self._applied[(chat_id, user_id)] = now + self.ttl
+
+
+forwarding_policy = ForwardingPolicy(Config.FORWARD_RESTRICT_TTL)
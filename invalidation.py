@@ -0,0 +1,249 @@
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from config import Config
+from models import db, movies, change_stream_tokens
+from database import movie_cache, stream_filter
+from templates import caption_cache, invalidate_movie
+from user_registry import user_registry
+
+logger = logging.getLogger(__name__)
+
+# Movie updates that touch only these fields don't change anything cached
+IGNORED_MOVIE_FIELDS = frozenset({'views'})
+
+# Events that end the stream: everything cached may be stale afterwards
+STREAM_ENDING_EVENTS = frozenset({'drop', 'rename', 'dropDatabase', 'invalidate'})
+
+# Server error codes meaning the stream cannot be resumed from the saved token
+HISTORY_LOST_CODES = frozenset({136, 260, 280, 286})
+
+# $changeStream is only available on replica sets and sharded clusters
+NOT_SUPPORTED_CODES = frozenset({40573})
+
+TOKEN_SAVE_INTERVAL = 5  # seconds
+RETRY_DELAY = 5  # seconds
+
+WATCH_PIPELINE = [{'$match': {'$or': [
+    {'ns.coll': 'movies'},
+    # New users only matter if they arrive banned or as admins
+    {'ns.coll': 'users', 'operationType': {'$in': ['insert', 'replace']},
+     '$or': [{'fullDocument.is_banned': True}, {'fullDocument.is_admin': True}]},
+    # last_active updates are frequent and never change roles
+    {'ns.coll': 'users', 'operationType': 'update',
+     '$or': [{'updateDescription.updatedFields.is_banned': {'$exists': True}},
+             {'updateDescription.updatedFields.is_admin': {'$exists': True}}]},
+    {'operationType': {'$in': list(STREAM_ENDING_EVENTS)}},
+]}}]
+
+
+class InvalidationBus:
+    """
+    Keeps this process's caches coherent with writes made by other processes.
+
+    A background thread follows a MongoDB change stream over movies and
+    users. Any database reads an event needs happen on that thread; only
+    the resulting in-memory changes are handed to the event loop, where
+    movie documents and rendered captions are evicted, new stream_ids are
+    added to the stream filter and ban/admin changes are applied to the
+    user registry. Handlers on the loop never wait on the database because
+    of an event. The resume token is saved regularly, so a restart
+    continues where the last run stopped.
+
+    While the stream is healthy movies are cached for COHERENT_CACHE_TIME.
+    If the stream is lost, or its history no longer reaches the saved
+    token, every cache is flushed and the short CACHE_TIME applies until
+    the stream is back.
+    """
+
+    def __init__(self, instance_name: str):
+        self.instance_name = instance_name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._token: Optional[Dict] = None
+        self._saved_token: Optional[Dict] = None
+        self.healthy = False
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Start following the change stream; events are applied on `loop`."""
+        if not Config.CHANGE_STREAMS_ENABLED or self._thread is not None:
+            return
+        self._loop = loop
+        self._token = self._load_token()
+        self._thread = threading.Thread(target=self._run, name='invalidation-bus', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the stream and save the resume token."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._save_token()
+
+    def _load_token(self) -> Optional[Dict]:
+        try:
+            doc = change_stream_tokens.find_one({'_id': self.instance_name})
+        except PyMongoError as e:
+            logger.error(f"Error loading change stream resume token: {e}")
+            return None
+        return doc['token'] if doc else None
+
+    def _save_token(self) -> None:
+        token = self._token
+        if token is None or token == self._saved_token:
+            return
+        try:
+            change_stream_tokens.update_one(
+                {'_id': self.instance_name},
+                {'$set': {'token': token, 'updated_at': datetime.utcnow()}},
+                upsert=True
+            )
+            self._saved_token = token
+        except PyMongoError as e:
+            logger.error(f"Error saving change stream resume token: {e}")
+
+    def _forget_token(self) -> None:
+        self._token = self._saved_token = None
+        try:
+            change_stream_tokens.delete_one({'_id': self.instance_name})
+        except PyMongoError as e:
+            logger.error(f"Error removing change stream resume token: {e}")
+
+    def _run(self) -> None:
+        lost = False
+        while not self._stopped.is_set():
+            try:
+                with db.watch(WATCH_PIPELINE, resume_after=self._token, max_await_time_ms=1000,
+                              full_document='updateLookup') as stream:
+                    self._set_healthy(True)
+                    if lost:
+                        # Events between losing and reopening the stream were never seen
+                        self._flush_all()
+                        lost = False
+                    last_save = time.monotonic()
+                    while not self._stopped.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self._apply(change)
+                        self._token = stream.resume_token
+                        if time.monotonic() - last_save >= TOKEN_SAVE_INTERVAL:
+                            self._save_token()
+                            last_save = time.monotonic()
+                        if change is not None and change['operationType'] in STREAM_ENDING_EVENTS:
+                            # The token of an invalidate event cannot be resumed after
+                            self._forget_token()
+                            lost = True
+                            break
+            except OperationFailure as e:
+                if e.code in NOT_SUPPORTED_CODES:
+                    logger.warning("Change streams need a replica set, cache coherence disabled")
+                    self._set_healthy(False)
+                    return
+                if e.code in HISTORY_LOST_CODES:
+                    logger.warning(f"Change stream can't resume from saved token, starting fresh: {e}")
+                    self._forget_token()
+                else:
+                    logger.error(f"Change stream failed: {e}")
+                lost = True
+            except PyMongoError as e:
+                logger.error(f"Change stream lost: {e}")
+                lost = True
+            if lost:
+                self._set_healthy(False)
+                self._flush_all()
+                self._stopped.wait(RETRY_DELAY)
+
+    def _set_healthy(self, healthy: bool) -> None:
+        if healthy != self.healthy:
+            self.healthy = healthy
+            movie_cache.ttl = Config.COHERENT_CACHE_TIME if healthy else Config.CACHE_TIME
+
+    def _dispatch(self, func, *args: Any) -> None:
+        try:
+            self._loop.call_soon_threadsafe(func, *args)
+        except RuntimeError:
+            # Event loop already closed during shutdown
+            pass
+
+    def _apply(self, change: Dict) -> None:
+        """Turn one change event into cache updates. Runs on the stream thread."""
+        try:
+            operation = change['operationType']
+            if operation in STREAM_ENDING_EVENTS:
+                # The stream loop flushes and reopens
+                return
+            if change['ns']['coll'] == 'movies':
+                self._apply_movie(operation, change)
+            elif change['ns']['coll'] == 'users':
+                self._apply_user(operation, change)
+        except Exception as e:
+            logger.error(f"Error applying change event, flushing caches: {e}")
+            self._flush_all()
+
+    def _apply_movie(self, operation: str, change: Dict) -> None:
+        if operation == 'insert':
+            self._dispatch(stream_filter.add, change['fullDocument']['stream_id'])
+            return
+        if operation == 'update':
+            updated = change['updateDescription']
+            changed = set(updated.get('updatedFields', {})) | set(updated.get('removedFields', []))
+            if changed <= IGNORED_MOVIE_FIELDS:
+                return
+        # updateLookup supplies the document for updates; deletes only carry the _id
+        full_document = change.get('fullDocument') or {}
+        self._dispatch(self._evict_movie, change['documentKey']['_id'], full_document.get('stream_id'))
+
+    def _apply_user(self, operation: str, change: Dict) -> None:
+        doc = change.get('fullDocument')
+        if doc is None:
+            # Deleted again before the update was looked up
+            return
+        if operation == 'update':
+            fields = change['updateDescription']['updatedFields']
+            self._dispatch(user_registry.apply_roles, doc['telegram_id'],
+                           fields.get('is_banned'), fields.get('is_admin'))
+        else:
+            self._dispatch(user_registry.apply_roles, doc['telegram_id'],
+                           bool(doc.get('is_banned')), bool(doc.get('is_admin')))
+
+    @staticmethod
+    def _evict_movie(document_id: Any, stream_id: Optional[str]) -> None:
+        """Drop a changed movie and its rendered captions. Runs on the event loop."""
+        stream_id = movie_cache.invalidate_id(document_id) or stream_id
+        if stream_id is not None:
+            movie_cache.invalidate(stream_id)
+            invalidate_movie(stream_id)
+
+    @staticmethod
+    def _clear_local() -> None:
+        movie_cache.clear()
+        caption_cache.clear()
+
+    def _flush_all(self) -> None:
+        """
+        Drop everything that may have missed an update. Runs on the stream thread.
+
+        The caches are cleared on the event loop. Roles and stream_ids are
+        reloaded here, since both swap in their new state under their own
+        locks or by assignment.
+        """
+        logger.info("Flushing local caches")
+        self._dispatch(self._clear_local)
+        user_registry.refresh_roles()
+        try:
+            stream_filter.sync(movies)
+        except Exception as e:
+            logger.error(f"Error syncing stream ID filter: {e}")
+
+
+def create_invalidation_bus(role: str) -> InvalidationBus:
+    """Bus for one process; `role` keeps processes on the same host apart."""
+    return InvalidationBus(f"{Config.INSTANCE_NAME}:{role}")
@@ -0,0 +1,113 @@
+import signal
+import asyncio
+import inspect
+import logging
+from typing import Awaitable, Callable, List, Optional, Union
+
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+Hook = Callable[[], Union[None, Awaitable[None]]]
+
+
+class Lifecycle:
+    """
+    Runs applications until SIGTERM or SIGINT, then drains them.
+
+    Draining happens in stages so no work is lost on a restart:
+
+    1. Every updater stops polling, so a replacement process can take the
+       token over at once and no new updates are accepted here.
+    2. Drain hooks run, e.g. suspending long background jobs that resume
+       from a checkpoint in the next process.
+    3. Each application is stopped, which waits for in-flight handlers,
+       running jobs and background tasks, up to the drain deadline.
+       Drain hooks that wait for work share the same deadline through
+       remaining(), so the whole drain never takes longer than
+       drain_timeout.
+    4. Shutdown hooks run to flush write-behind buffers to the database.
+    5. Applications are shut down.
+
+    Heroku sends SIGKILL 30 seconds after SIGTERM, so the deadline should
+    leave room for the flush.
+    """
+
+    def __init__(self, drain_timeout: float):
+        self.drain_timeout = drain_timeout
+        self._stop = asyncio.Event()
+        self._deadline: Optional[float] = None
+        self._drain_hooks: List[Hook] = []
+        self._shutdown_hooks: List[Hook] = []
+
+    def on_drain(self, hook: Hook) -> None:
+        """Run a hook after polling stops, before waiting for in-flight work."""
+        self._drain_hooks.append(hook)
+
+    def on_shutdown(self, hook: Hook) -> None:
+        """Run a hook once the applications have stopped."""
+        self._shutdown_hooks.append(hook)
+
+    def remaining(self) -> float:
+        """Seconds left before the drain deadline, or the full timeout before draining starts."""
+        if self._deadline is None:
+            return self.drain_timeout
+        return max(0.0, self._deadline - asyncio.get_running_loop().time())
+
+    def request_stop(self) -> None:
+        self._stop.set()
+
+    async def wait(self) -> None:
+        """Block until a stop signal arrives."""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_stop)
+            except (NotImplementedError, RuntimeError):
+                # Not available on Windows or outside the main thread
+                pass
+        await self._stop.wait()
+        logger.info("Stop signal received, draining")
+
+    async def _run_hooks(self, hooks: List[Hook]) -> None:
+        for hook in hooks:
+            try:
+                result = hook()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error in shutdown hook {getattr(hook, '__qualname__', hook)}: {e}")
+
+    async def drain(self, applications: List[Application]) -> None:
+        """Stop taking updates, finish in-flight work and flush buffers."""
+        self._deadline = asyncio.get_running_loop().time() + self.drain_timeout
+        for application in applications:
+            updater = application.updater
+            if updater and updater.running:
+                try:
+                    await updater.stop()
+                except Exception as e:
+                    logger.error(f"Error stopping updater: {e}")
+
+        await self._run_hooks(self._drain_hooks)
+
+        running = [application for application in applications if application.running]
+        if running:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(application.stop() for application in running)),
+                    timeout=self.remaining()
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"In-flight work still running after {self.drain_timeout}s, cancelled")
+            except Exception as e:
+                logger.error(f"Error stopping application: {e}")
+
+        await self._run_hooks(self._shutdown_hooks)
+
+        for application in applications:
+            try:
+                await application.shutdown()
+            except Exception as e:
+                logger.error(f"Error shutting down application: {e}")
+        logger.info("Shutdown complete")
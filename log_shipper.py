@@ -0,0 +1,185 @@
+import html
+import queue
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Bot
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter, TelegramError
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Loggers whose records are never shipped, to avoid feedback loops when
+# sending to the channel itself logs or fails. telegram.* is shipped: it
+# reports unhandled handler errors, and this module's send failures are
+# logged under its own name.
+IGNORED_LOGGERS = ('httpx', 'httpcore', __name__)
+
+# Longer messages are cut, after escaping, so one record cannot fill a whole batch
+MAX_LINE_LENGTH = 1000
+
+
+def _escape_line(text: str) -> str:
+    """HTML-escape a log line and cut it to MAX_LINE_LENGTH without splitting an entity."""
+    escaped = html.escape(text)
+    if len(escaped) <= MAX_LINE_LENGTH:
+        return escaped
+    cut = escaped[:MAX_LINE_LENGTH]
+    entity = cut.rfind('&')
+    if entity != -1 and ';' not in cut[entity:]:
+        cut = cut[:entity]
+    return cut + '…'
+
+
+class LogChannelHandler(logging.Handler):
+    """
+    Logging handler that ships records to LOG_CHANNEL in batches.
+
+    emit() only formats the record and puts it on a bounded queue, so it
+    never blocks the caller; records are dropped and counted when the queue
+    is full. A background task drains the queue every flush interval,
+    collapses repeated messages into one line with a count, and packs the
+    result into as few Telegram messages as the length limit allows.
+    """
+
+    def __init__(self, chat_id: int, level: int = logging.WARNING, max_pending: int = 1000,
+                 flush_interval: float = 5.0, max_messages_per_flush: int = 5):
+        super().__init__(level)
+        self.chat_id = chat_id
+        self.flush_interval = flush_interval
+        self.max_messages_per_flush = max_messages_per_flush
+        self._queue: 'queue.Queue[Tuple[str, str]]' = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.shipped = 0
+        self._task: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.name.startswith(IGNORED_LOGGERS):
+            return False
+        return super().filter(record)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            summary = f"{record.levelname} {record.name}: {record.getMessage()}"
+            if record.exc_info and record.exc_info[1] is not None:
+                summary += f" ({type(record.exc_info[1]).__name__}: {record.exc_info[1]})"
+            self._queue.put_nowait((record.levelname, summary))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _drain(self) -> Tuple[Dict[str, int], Dict[str, str]]:
+        """Take everything pending, counting repeats of the same message."""
+        counts: Dict[str, int] = OrderedDict()
+        levels: Dict[str, str] = {}
+        while True:
+            try:
+                level, summary = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            counts[summary] = counts.get(summary, 0) + 1
+            levels[summary] = level
+        return counts, levels
+
+    def _pack(self, counts: Dict[str, int], levels: Dict[str, str], dropped: int) -> List[str]:
+        """Pack de-duplicated lines into messages within Telegram's length limit."""
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        icons = {'WARNING': '⚠️', 'ERROR': '❌', 'CRITICAL': '🔥'}
+        lines = []
+        for summary, count in counts.items():
+            repeat = f" <b>×{count}</b>" if count > 1 else ""
+            lines.append(f"{icons.get(levels[summary], 'ℹ️')} <code>{_escape_line(summary)}</code>{repeat}")
+        if dropped:
+            lines.append(f"🗑 {dropped} log records dropped (queue full or rate limited)")
+
+        messages, current = [], ""
+        for line in lines:
+            if current and len(current) + 1 + len(line) > limit:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n{line}" if current else line
+        if current:
+            messages.append(current)
+        return messages
+
+    async def flush_async(self) -> None:
+        """Send everything pending now."""
+        if self._bot is None:
+            return
+        counts, levels = self._drain()
+        dropped, self.dropped = self.dropped, 0
+        if not counts and not dropped:
+            return
+        messages = self._pack(counts, levels, dropped)
+        overflow = len(messages) - self.max_messages_per_flush
+        if overflow > 0:
+            messages = messages[:self.max_messages_per_flush]
+            messages[-1] += f"\n… {overflow} more message(s) of logs suppressed"
+        for text in messages:
+            for attempt in range(2):
+                try:
+                    await self._bot.send_message(
+                        self.chat_id, text, parse_mode='HTML', disable_web_page_preview=True
+                    )
+                    self.shipped += 1
+                    break
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                    if attempt:
+                        # Rate limited twice: report the lost lines in the next flush
+                        self.dropped += text.count('\n') + 1
+                except TelegramError as e:
+                    logger.debug(f"Could not ship logs to channel: {e}")
+                    break
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_async()
+            except Exception as e:
+                logger.debug(f"Log shipping failed: {e}")
+
+    def start(self, bot: Bot) -> None:
+        """Start shipping with the given bot."""
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task after a final flush."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush_async()
+
+
+log_shipper: Optional[LogChannelHandler] = None
+
+
+def install_log_shipper(bot: Bot) -> Optional[LogChannelHandler]:
+    """
+    Attach a LogChannelHandler to the root logger if LOG_CHANNEL is set.
+
+    Must be called from the running event loop; calling it again reuses the
+    installed handler.
+    """
+    global log_shipper
+    if not Config.LOG_CHANNEL:
+        return None
+    if log_shipper is None:
+        log_shipper = LogChannelHandler(
+            Config.LOG_CHANNEL,
+            level=logging.getLevelName(Config.LOG_CHANNEL_LEVEL),
+            max_pending=Config.LOG_CHANNEL_MAX_PENDING,
+            flush_interval=Config.LOG_CHANNEL_FLUSH_INTERVAL
+        )
+        logging.getLogger().addHandler(log_shipper)
+    log_shipper.start(bot)
+    return log_shipper
@@ -2,10 +2,13 @@ from typing import Optional, Dict, List
 import logging
 from datetime import datetime
 from pymongo import MongoClient
+from pymongo.read_preferences import SecondaryPreferred
 import os
 from urllib.parse import quote_plus, urlparse, parse_qs
 import certifi
 import json
+from config import Config
+from pool_metrics import pool_metrics
 
 # Configure logging
 logging.basicConfig(
@@ -78,25 +81,83 @@ def get_mongodb_uri() -> str:
         logger.error(f"Error processing MongoDB URI: {str(e)}")
         raise
 
+# Connection pool profiles, sized by dyno class
+POOL_PROFILES = {
+    'small': {
+        'maxPoolSize': 10,
+        'minPoolSize': 1,
+        'maxIdleTimeMS': 30000,
+        'waitQueueTimeoutMS': 5000,
+        'socketTimeoutMS': 20000
+    },
+    'standard': {
+        'maxPoolSize': 50,
+        'minPoolSize': 10,
+        'maxIdleTimeMS': 50000,
+        'waitQueueTimeoutMS': 5000,
+        'socketTimeoutMS': 30000
+    },
+    'large': {
+        'maxPoolSize': 200,
+        'minPoolSize': 20,
+        'maxIdleTimeMS': 120000,
+        'waitQueueTimeoutMS': 10000,
+        'socketTimeoutMS': 60000
+    }
+}
+
+def get_available_compressors() -> List[str]:
+    """Requested wire compressors whose libraries are installed, in preference order."""
+    available = []
+    for name in Config.MONGO_COMPRESSORS:
+        try:
+            if name == 'zstd':
+                import zstandard  # noqa: F401
+            elif name == 'snappy':
+                import snappy  # noqa: F401
+            elif name != 'zlib':
+                continue
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+def get_client_options() -> Dict:
+    """Build MongoClient options from the pool profile and connection settings."""
+    profile = POOL_PROFILES.get(Config.MONGO_POOL_PROFILE)
+    if profile is None:
+        logger.warning(f"Unknown MONGO_POOL_PROFILE '{Config.MONGO_POOL_PROFILE}', using 'standard'")
+        profile = POOL_PROFILES['standard']
+    options = dict(profile)
+    if Config.MAX_CONNECTIONS:
+        options['maxPoolSize'] = Config.MAX_CONNECTIONS
+        options['minPoolSize'] = min(options['minPoolSize'], Config.MAX_CONNECTIONS)
+    options['connectTimeoutMS'] = Config.CONNECTION_TIMEOUT
+    options['serverSelectionTimeoutMS'] = Config.CONNECTION_TIMEOUT
+    compressors = get_available_compressors()
+    if compressors:
+        options['compressors'] = ','.join(compressors)
+    return options
+
 try:
     # Get MongoDB URI with validation
     MONGODB_URI = get_mongodb_uri()
     logger.info("Got MongoDB URI")
     
     # Create MongoDB client with robust settings
+    client_options = get_client_options()
     client = MongoClient(
         MONGODB_URI,
-        serverSelectionTimeoutMS=5000,
-        connectTimeoutMS=5000,
-        socketTimeoutMS=5000,
         tlsCAFile=certifi.where(),
         retryWrites=True,
-        maxPoolSize=50,
-        minPoolSize=10,
-        maxIdleTimeMS=50000,
-        waitQueueTimeoutMS=5000
+        event_listeners=[pool_metrics],
+        **client_options
+    )
+    logger.info(
+        f"Created MongoDB client (profile={Config.MONGO_POOL_PROFILE}, "
+        f"maxPoolSize={client_options['maxPoolSize']}, "
+        f"compressors={client_options.get('compressors', 'none')})"
     )
-    logger.info("Created MongoDB client")
     
     # Test connection
     client.admin.command('ping')
@@ -112,11 +173,45 @@ try:
     files = db.files
     statistics = db.statistics
     
+    # Stats and search tolerate slightly stale data and can be served by secondaries
+    movies_secondary = movies.with_options(
+        read_preference=SecondaryPreferred(max_staleness=Config.MONGO_MAX_STALENESS)
+    )
+    rate_limits = db.rate_limits
+    broadcasts = db.broadcasts
+    access_tokens = db.access_tokens
+    deliveries = db.deliveries
+    workers = db.workers
+    worker_file_ids = db.worker_file_ids
+    popularity = db.popularity
+    change_stream_tokens = db.change_stream_tokens
+    
     # Create indexes
     users.create_index("telegram_id", unique=True)
     movies.create_index("stream_id", unique=True)
     movies.create_index("title")
+    movies.create_index("created_at")
+    movies.create_index(
+        "canonical_url", unique=True,
+        partialFilterExpression={"canonical_url": {"$exists": True}}
+    )
+    movies.create_index(
+        "fingerprint", unique=True,
+        partialFilterExpression={"fingerprint": {"$exists": True}}
+    )
     files.create_index("stream_id", unique=True)
+    rate_limits.create_index("expires_at", expireAfterSeconds=0)
+    broadcasts.create_index("status")
+    
+    # TTL indexes: MongoDB removes documents once their expiry time passes
+    movies.create_index("expires_at", expireAfterSeconds=0)
+    access_tokens.create_index("token", unique=True)
+    access_tokens.create_index("expires_at", expireAfterSeconds=0)
+    deliveries.create_index([("bot_id", 1), ("delete_at", 1)])
+    deliveries.create_index("purge_at", expireAfterSeconds=0)
+    workers.create_index("heartbeat_at")
+    worker_file_ids.create_index([("bot_id", 1), ("stream_id", 1), ("kind", 1)], unique=True)
+    popularity.create_index([("log_score", -1)])
     
     logger.info("Successfully initialized all collections and indexes")
     
@@ -130,6 +225,7 @@ USER_SCHEMA = {
     "is_admin": bool,
     "is_banned": bool,
     "joined_date": datetime,
+    "last_active": datetime,
     "last_search": datetime
 }
 
@@ -140,11 +236,49 @@ MOVIE_SCHEMA = {
     "genre": str,
     "stream_id": str,
     "file_url": str,
+    "canonical_url": str,
+    "fingerprint": str,
     "file_size": float,
+    "file_id": str,
+    "file_name": str,
+    "mime_type": str,
+    "storage_chat_id": int,
+    "storage_message_id": int,
     "duration": int,
     "views": int,
     "created_at": datetime,
     "uploader_id": str,
     "short_url_get2short": str,
-    "short_url_modijiurl": str
-}
\ No newline at end of file
+    "short_url_modijiurl": str,
+    "expires_at": datetime
+}
+
+ACCESS_TOKEN_SCHEMA = {
+    "token": str,
+    "user_id": int,
+    "stream_id": str,
+    "expires_at": datetime
+}
+
+DELIVERY_SCHEMA = {
+    "bot_id": int,
+    "chat_id": int,
+    "message_id": int,
+    "notify": bool,
+    "delete_at": datetime,
+    "purge_at": datetime,
+    "claimed_by": str,
+    "claimed_at": datetime
+}
+
+POPULARITY_SCHEMA = {
+    "_id": str,  # stream_id
+    "log_score": float,
+    "updated_at": datetime
+}
+
+CHANGE_STREAM_TOKEN_SCHEMA = {
+    "_id": str,  # instance name
+    "token": dict,
+    "updated_at": datetime
+}
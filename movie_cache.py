@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class MovieCache:
+    """
+    LRU cache of movie documents keyed by stream_id.
+
+    Entries are served for at most `ttl` seconds, so a movie edited or
+    removed elsewhere is picked up again within that time. Only hits are
+    cached; a missing movie is always looked up again so new uploads show
+    up immediately.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+        # Document _id to stream_id, for evictions that only know the _id
+        self._stream_ids: Dict[Any, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, stream_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(stream_id)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._remove(stream_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(stream_id)
+            self.hits += 1
+            return entry[1]
+
+    def get_many(self, stream_ids: Iterable[str]) -> Tuple[Dict[str, Dict], List[str]]:
+        """
+        Look up several movies at once.
+
+        Returns:
+            Tuple of (cached documents by stream_id, stream_ids not cached)
+        """
+        found, missing = {}, []
+        for stream_id in stream_ids:
+            movie = self.get(stream_id)
+            if movie is None:
+                missing.append(stream_id)
+            else:
+                found[stream_id] = movie
+        return found, missing
+
+    def put(self, movie: Dict) -> None:
+        with self._lock:
+            stream_id = movie['stream_id']
+            self._entries[stream_id] = (time.monotonic() + self.ttl, movie)
+            self._entries.move_to_end(stream_id)
+            if '_id' in movie:
+                self._stream_ids[movie['_id']] = stream_id
+            if len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, stream_id: str) -> None:
+        entry = self._entries.pop(stream_id, None)
+        if entry is not None:
+            self._stream_ids.pop(entry[1].get('_id'), None)
+
+    def invalidate(self, stream_id: str) -> None:
+        with self._lock:
+            self._remove(stream_id)
+
+    def invalidate_id(self, document_id: Any) -> Optional[str]:
+        """
+        Evict a movie by its document _id.
+
+        Returns:
+            The evicted movie's stream_id, or None if it was not cached
+        """
+        with self._lock:
+            stream_id = self._stream_ids.get(document_id)
+            if stream_id is not None:
+                self._remove(stream_id)
+            return stream_id
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stream_ids.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -2,10 +2,8 @@ import os
 import asyncio
 import aiohttp
 from typing import Optional, Dict
-from datetime import datetime
-from database import get_db, create_movie
-import hashlib
-import json
+from database import create_movie, DuplicateMovieError
+from dedupe import canonicalize_url, fingerprint_url, stream_id_for
 
 class MovieProcessor:
     def __init__(self):
@@ -27,24 +25,27 @@ class MovieProcessor:
         if platform not in self.supported_platforms:
             raise ValueError(f"Unsupported platform: {platform}")
         
-        # Generate unique stream ID
-        stream_id = self._generate_stream_id(title, file_url)
-        
         # Process the URL based on platform
         processed_url = await self.supported_platforms[platform](file_url)
         
+        # Same file, same stream ID: the ID derives from the canonical URL
+        stream_id = self._generate_stream_id(title, processed_url)
+        fingerprint = await fingerprint_url(processed_url) if platform == 'direct' else None
+        
         # Store in database
-        with get_db() as db:
-            movie = create_movie(
-                db=db,
+        try:
+            create_movie(
                 title=title,
                 stream_id=stream_id,
                 file_url=processed_url,
                 description=description,
                 year=year,
                 genre=genre,
-                uploader_id=0  # System upload
+                uploader_id="0",  # System upload
+                fingerprint=fingerprint
             )
+        except DuplicateMovieError as e:
+            stream_id = e.existing['stream_id']
         
         return {
             'stream_id': stream_id,
@@ -54,9 +55,8 @@ class MovieProcessor:
         }
     
     def _generate_stream_id(self, title: str, url: str) -> str:
-        """Generate unique stream ID."""
-        unique_string = f"{title}{url}{datetime.now().isoformat()}"
-        return hashlib.sha256(unique_string.encode()).hexdigest()[:16]
+        """Generate a stream ID that is stable for the same file."""
+        return stream_id_for(canonicalize_url(url))
     
     async def _process_gdrive(self, url: str) -> str:
         """Process Google Drive links."""
@@ -0,0 +1,104 @@
+import time
+import threading
+from bisect import bisect_left
+from typing import Any, Dict
+
+from pymongo import monitoring
+
+# Upper bounds of the checkout wait histogram, in milliseconds
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener recording how long operations wait for a
+    connection, so the pool can be sized from data.
+
+    Checkout is synchronous in the calling thread, so the start time is kept
+    in a thread-local between the started and checked-out events.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_failures: Dict[str, int] = {}
+            self.wait_total_ms = 0.0
+            self.wait_max_ms = 0.0
+            self.wait_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+            self.open_connections = 0
+            self.checked_out = 0
+            self.pool_clears = 0
+
+    def _record_wait(self) -> float:
+        started = getattr(self._local, 'started', None)
+        self._local.started = None
+        return (time.monotonic() - started) * 1000 if started is not None else 0.0
+
+    def connection_check_out_started(self, event) -> None:
+        self._local.started = time.monotonic()
+
+    def connection_checked_out(self, event) -> None:
+        wait_ms = self._record_wait()
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.wait_total_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            self.wait_histogram[bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+
+    def connection_check_out_failed(self, event) -> None:
+        self._record_wait()
+        with self._lock:
+            reason = str(event.reason)
+            self.checkout_failures[reason] = self.checkout_failures.get(reason, 0) + 1
+
+    def connection_checked_in(self, event) -> None:
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def connection_created(self, event) -> None:
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event) -> None:
+        with self._lock:
+            self.open_connections = max(0, self.open_connections - 1)
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current metrics as a plain dict."""
+        with self._lock:
+            labels = [f"<={bound}ms" for bound in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                'checkouts': self.checkouts,
+                'checkout_failures': dict(self.checkout_failures),
+                'wait_avg_ms': self.wait_total_ms / self.checkouts if self.checkouts else 0.0,
+                'wait_max_ms': self.wait_max_ms,
+                'wait_histogram': dict(zip(labels, self.wait_histogram)),
+                'open_connections': self.open_connections,
+                'checked_out': self.checked_out,
+                'pool_clears': self.pool_clears
+            }
+
+
+pool_metrics = PoolMetrics()
@@ -0,0 +1,214 @@
+import math
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from telegram.ext import Application, CallbackContext
+
+from config import Config
+from models import popularity
+from database import bulk_increment_movie_views, get_movies_by_stream_ids
+from templates import VERIFICATION_MESSAGE, delivery_caption, render_movie
+from worker_pool import WorkerState
+
+logger = logging.getLogger(__name__)
+
+# Forward decay landmark: scores are stored relative to this instant, so
+# they never need to be decayed in place and their order never changes
+LANDMARK = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+
+# Stands in for log(0) in the server-side update of a missing score
+NO_SCORE = -1e9
+
+
+def _log_add(a: float, b: float) -> float:
+    """log(exp(a) + exp(b)) without overflow."""
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+class PopularityTracker:
+    """
+    Time-decayed view scores per stream_id, using forward decay.
+
+    A view at time t adds exp(rate * (t - LANDMARK)) to the movie's score,
+    where rate = ln 2 / half-life. Dividing by exp(rate * (now - LANDMARK))
+    gives the decayed score at any later time, and since that divisor is the
+    same for every movie, ranking by the stored score is ranking by the
+    decayed one. Scores are kept as logarithms so they cannot overflow.
+
+    Views are aggregated in memory and merged into the popularity collection
+    on each persist with one server-side log-add per movie, so several
+    processes can record views without overwriting each other. The top
+    movies are held in a small sorted list, so trending reads are a slice.
+    """
+
+    def __init__(self, half_life_hours: float, top_size: int):
+        self.rate = math.log(2) / (half_life_hours * 3600)
+        self.top_size = top_size
+        self._scores: Dict[str, float] = {}
+        self._pending: Dict[str, float] = {}
+        self._pending_views: Dict[str, int] = {}
+        self._top: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def _now_score(self, timestamp: float = None) -> float:
+        return self.rate * ((timestamp or time.time()) - LANDMARK)
+
+    def record_view(self, stream_id: str) -> None:
+        """Count one view of a movie."""
+        point = self._now_score()
+        with self._lock:
+            pending = self._pending.get(stream_id)
+            self._pending[stream_id] = point if pending is None else _log_add(pending, point)
+            self._pending_views[stream_id] = self._pending_views.get(stream_id, 0) + 1
+            score = self._scores.get(stream_id)
+            score = point if score is None else _log_add(score, point)
+            self._scores[stream_id] = score
+            self._update_top(stream_id, score)
+
+    def _update_top(self, stream_id: str, score: float) -> None:
+        top = [entry for entry in self._top if entry[1] != stream_id]
+        if len(top) < self.top_size or score > top[-1][0]:
+            top.append((score, stream_id))
+            top.sort(reverse=True)
+            del top[self.top_size:]
+        self._top = top
+        # Only movies near the top are worth remembering between refreshes
+        if len(self._scores) > self.top_size * 4:
+            keep = {sid for _, sid in top} | set(self._pending)
+            self._scores = {sid: s for sid, s in self._scores.items() if sid in keep}
+
+    def top(self, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        The currently most popular movies.
+
+        Returns:
+            (stream_id, decayed score) pairs, most popular first; the score
+            counts each view as 1, halved for every half-life since it happened
+        """
+        now = self._now_score()
+        return [(stream_id, math.exp(score - now)) for score, stream_id in self._top[:limit]]
+
+    def persist(self) -> int:
+        """
+        Merge pending views into the popularity collection and the movies' view counters.
+
+        Returns:
+            Number of movies written
+        """
+        with self._lock:
+            if not self._pending and not self._pending_views:
+                return 0
+            pending, self._pending = self._pending, {}
+            views, self._pending_views = self._pending_views, {}
+        now = datetime.utcnow()
+        stream_ids = list(pending)
+        operations = []
+        for stream_id in stream_ids:
+            delta = pending[stream_id]
+            current = {'$ifNull': ['$log_score', NO_SCORE]}
+            high = {'$max': [current, delta]}
+            low = {'$min': [current, delta]}
+            operations.append(UpdateOne(
+                {'_id': stream_id},
+                [{'$set': {
+                    'log_score': {'$add': [high, {'$ln': {'$add': [1, {'$exp': {'$subtract': [low, high]}}]}}]},
+                    'updated_at': now
+                }}],
+                upsert=True
+            ))
+        # Scores and view counters are requeued separately, so a failure of
+        # one never makes the other count the same views twice
+        failed_scores: List[str] = []
+        try:
+            if operations:
+                popularity.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            failed_scores = [stream_ids[error['index']] for error in e.details.get('writeErrors', [])]
+            logger.error(f"Error persisting popularity for {len(failed_scores)} movies: {e}")
+        except Exception as e:
+            failed_scores = stream_ids
+            logger.error(f"Error persisting popularity for {len(operations)} movies: {e}")
+        failed_views: Dict[str, int] = {}
+        try:
+            bulk_increment_movie_views(views)
+        except Exception as e:
+            failed_views = views
+            logger.error(f"Error persisting view counts for {len(views)} movies: {e}")
+
+        if failed_scores or failed_views:
+            with self._lock:
+                for stream_id in failed_scores:
+                    delta, current = pending[stream_id], self._pending.get(stream_id)
+                    self._pending[stream_id] = delta if current is None else _log_add(current, delta)
+                for stream_id, count in failed_views.items():
+                    self._pending_views[stream_id] = self._pending_views.get(stream_id, 0) + count
+        return len(operations) - len(failed_scores)
+
+    def refresh(self) -> None:
+        """Reload the top movies from the collection, including other processes' views."""
+        try:
+            docs = list(popularity.find({}, {'log_score': 1}).sort('log_score', -1).limit(self.top_size))
+        except Exception as e:
+            logger.error(f"Error loading popularity scores: {e}")
+            return
+        with self._lock:
+            scores = {doc['_id']: doc['log_score'] for doc in docs}
+            # Views recorded since the last persist are not in the collection yet
+            for stream_id, delta in self._pending.items():
+                current = scores.get(stream_id)
+                scores[stream_id] = delta if current is None else _log_add(current, delta)
+            self._scores = scores
+            self._top = sorted(((score, sid) for sid, score in scores.items()), reverse=True)[:self.top_size]
+
+    def flush(self) -> None:
+        """Persist pending views and reload the shared ranking."""
+        self.persist()
+        self.refresh()
+
+
+popularity_tracker = PopularityTracker(Config.POPULARITY_HALF_LIFE, Config.POPULARITY_TOP_SIZE)
+
+
+async def _persist_popularity(context: CallbackContext) -> None:
+    popularity_tracker.flush()
+
+
+def register_popularity(application: Application) -> None:
+    """Load the current ranking and schedule periodic persistence."""
+    popularity_tracker.refresh()
+    application.job_queue.run_repeating(_persist_popularity, interval=Config.POPULARITY_PERSIST_INTERVAL)
+
+
+def prewarm(states: List[WorkerState], limit: int = Config.POPULARITY_PREWARM) -> None:
+    """
+    Fill caches for the most popular movies before taking traffic.
+
+    Loads their documents into the movie cache, renders their captions and
+    loads each worker's file_ids for them, so the first requests after a
+    restart skip the database and reuse file_ids like in steady state.
+    """
+    if limit <= 0:
+        return
+    started = time.monotonic()
+    try:
+        stream_ids = [
+            doc['_id'] for doc in popularity.find({}, {'_id': 1}).sort('log_score', -1).limit(limit)
+        ]
+        movies = get_movies_by_stream_ids(stream_ids)
+        for movie in movies:
+            render_movie(VERIFICATION_MESSAGE, movie)
+            render_movie(delivery_caption(movie), movie)
+        file_ids = sum(state.preload_file_ids(stream_ids) for state in states)
+    except Exception as e:
+        logger.error(f"Error pre-warming caches: {e}")
+        return
+    logger.info(
+        f"Pre-warmed {len(movies)} movies and {file_ids} file_ids "
+        f"in {time.monotonic() - started:.2f}s"
+    )
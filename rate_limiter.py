@@ -0,0 +1,186 @@
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, Set
+
+from pymongo import ReturnDocument
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_TEXT = "⏳ Too many requests. Please wait a moment and try again."
+IN_FLIGHT_TEXT = "⏳ Your file is already being sent. Please wait."
+
+
+class TokenBucket:
+    """Single token bucket refilling at `rate` tokens per second up to `capacity`."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens if available. Returns False without waiting otherwise."""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` would be available."""
+        self._refill(time.monotonic())
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Wait until tokens are available, then take them."""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+
+class RateLimiter(ABC):
+    """Base class for per-key request limiters."""
+
+    def __init__(self, name: str, limit: int, window: int):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self._notified: Dict[Hashable, float] = {}
+
+    @abstractmethod
+    def hit(self, key: Hashable) -> bool:
+        """Record a request for key. Returns False if the key is throttled."""
+
+    def should_notify(self, key: Hashable) -> bool:
+        """
+        Whether a throttled key should get a reply.
+
+        Throttled users are told at most once per window so that flooding
+        doesn't turn into a flood of replies.
+        """
+        now = time.monotonic()
+        if now - self._notified.get(key, 0.0) < self.window:
+            return False
+        if len(self._notified) > 10000:
+            self._notified = {k: t for k, t in self._notified.items() if now - t < self.window}
+        self._notified[key] = now
+        return True
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Token-bucket limiter kept in process memory."""
+
+    def __init__(self, name: str, limit: int, window: int, max_keys: int = 50000):
+        super().__init__(name, limit, window)
+        self.max_keys = max_keys
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+
+    def hit(self, key: Hashable) -> bool:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune()
+            bucket = self._buckets[key] = TokenBucket(self.limit / self.window, self.limit)
+        return bucket.try_acquire()
+
+    def _prune(self) -> None:
+        """Drop buckets that have been idle long enough to be full again."""
+        cutoff = time.monotonic() - self.window
+        self._buckets = {k: b for k, b in self._buckets.items() if b.updated > cutoff}
+
+
+class MongoRateLimiter(RateLimiter):
+    """
+    Sliding-window counter limiter shared through MongoDB.
+
+    Each key keeps one document holding the counts of the current and the
+    previous fixed window; the estimate weights the previous window by how
+    much of it still overlaps the sliding window. Rolling the window over
+    happens in the same pipeline update that counts the request, so every
+    hit is a single round trip. Documents expire through a TTL index.
+    """
+
+    def __init__(self, name: str, limit: int, window: int, collection):
+        super().__init__(name, limit, window)
+        self.collection = collection
+
+    def hit(self, key: Hashable) -> bool:
+        now = time.time()
+        window_index = int(now // self.window)
+        elapsed = (now % self.window) / self.window
+        try:
+            counter = self.collection.find_one_and_update(
+                {'_id': f"{self.name}:{key}"},
+                [{'$set': {
+                    'previous': {'$switch': {
+                        'branches': [
+                            {'case': {'$eq': ['$window', window_index]}, 'then': '$previous'},
+                            {'case': {'$eq': ['$window', window_index - 1]}, 'then': '$count'}
+                        ],
+                        'default': 0
+                    }},
+                    'count': {'$cond': [
+                        {'$eq': ['$window', window_index]}, {'$add': ['$count', 1]}, 1
+                    ]},
+                    'window': window_index,
+                    'expires_at': datetime.utcnow() + timedelta(seconds=self.window * 2)
+                }}],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            # Fail open: a limiter outage must not take the bot down with it
+            logger.error(f"Rate limiter {self.name} unavailable: {e}")
+            return True
+
+        estimate = counter['count'] + counter['previous'] * (1 - elapsed)
+        return estimate <= self.limit
+
+
+class InFlightTracker:
+    """Set of keys with an operation currently running, used to drop duplicates."""
+
+    def __init__(self):
+        self._keys: Set[Hashable] = set()
+
+    def try_acquire(self, key: Hashable) -> bool:
+        """Mark key as in flight. Returns False if it already is."""
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        return True
+
+    def release(self, key: Hashable) -> None:
+        self._keys.discard(key)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+def create_rate_limiter(name: str, limit: int, window: int) -> RateLimiter:
+    """
+    Create a limiter using the configured backend.
+
+    Args:
+        name: Limiter name, used to namespace shared counters
+        limit: Requests allowed per window
+        window: Window length in seconds
+
+    Returns:
+        MongoRateLimiter if RATE_LIMIT_BACKEND is 'mongo', else MemoryRateLimiter
+    """
+    if Config.RATE_LIMIT_BACKEND == 'mongo':
+        from models import rate_limits
+        return MongoRateLimiter(name, limit, window, rate_limits)
+    return MemoryRateLimiter(name, limit, window)
@@ -0,0 +1,62 @@
+import logging
+from typing import Dict, Optional
+
+import aiohttp
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Movie field, service base URL and API key for each shortener.
+# verify_url_token accepts links on these hosts whose last path segment is
+# the stream_id, so links are requested with the stream_id as their alias.
+SHORTENERS = {
+    'short_url_get2short': ('https://get2short.com', Config.GET2SHORT_API_KEY),
+    'short_url_modijiurl': ('https://modijiurl.com', Config.MODIJIURL_API_KEY),
+}
+
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
+
+async def _shorten(session: aiohttp.ClientSession, base_url: str, api_key: str,
+                   stream_id: str, target: str) -> Optional[str]:
+    """Create one short link, returning None if the service did not give a usable one."""
+    data = {'api_key': api_key, 'url': target, 'alias': stream_id}
+    try:
+        async with session.post(f"{base_url}/api/create", json=data) as response:
+            if response.status != 200:
+                logger.error(f"{base_url} shortener error: {await response.text()}")
+                return None
+            result = await response.json(content_type=None)
+    except (aiohttp.ClientError, ValueError) as e:
+        logger.error(f"{base_url} shortener request failed: {e}")
+        return None
+
+    short_url = (result or {}).get('short_url') or (result or {}).get('shortenedUrl')
+    if not short_url or not short_url.startswith(f"{base_url}/") or short_url.rstrip('/').split('/')[-1] != stream_id:
+        logger.error(f"{base_url} shortener returned an unusable link: {short_url}")
+        return None
+    return short_url
+
+
+async def create_short_links(stream_id: str, target: str) -> Dict[str, str]:
+    """
+    Create short links for a movie on every configured shortener.
+
+    Args:
+        stream_id: The movie's stream ID, used as the link alias
+        target: URL the short links redirect to
+
+    Returns:
+        Movie fields (e.g. 'short_url_get2short') mapped to the created links;
+        services without an API key or that failed are left out
+    """
+    links = {}
+    async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
+        for field, (base_url, api_key) in SHORTENERS.items():
+            if not api_key:
+                continue
+            short_url = await _shorten(session, base_url, api_key, stream_id, target)
+            if short_url:
+                links[field] = short_url
+    return links
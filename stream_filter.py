@@ -0,0 +1,281 @@
+import os
+import math
+import time
+import struct
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from bson.objectid import ObjectId
+
+logger = logging.getLogger(__name__)
+
+# Snapshot header: magic, version, num_bits, num_hashes, count, synced_at
+_SNAPSHOT_MAGIC = b'SIDBLOOM'
+_SNAPSHOT_HEADER = struct.Struct('<8sHQIQd')
+_SNAPSHOT_VERSION = 1
+
+
+class BloomFilter:
+    """
+    Compact probabilistic set of strings.
+
+    A lookup that returns False means the key was definitely never added;
+    True means it probably was. Sizing follows the usual formulas
+    m = -n * ln(p) / ln(2)^2 and k = (m / n) * ln(2), which for a
+    1,000,000 key catalogue gives:
+
+        p = 1%    ->  9.6M bits (1.14 MiB), k = 7
+        p = 0.1%  -> 14.4M bits (1.71 MiB), k = 10
+        p = 0.01% -> 19.2M bits (2.29 MiB), k = 13
+
+    Each lookup is a single blake2b digest plus k bit tests, i.e. a few
+    microseconds in CPython.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> Iterable[int]:
+        """Yield bit positions for a key using double hashing."""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str) -> None:
+        """Add a key to the filter."""
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def size_bytes(self) -> int:
+        """Memory used by the bit array."""
+        return len(self.bits)
+
+    def expected_error_rate(self) -> float:
+        """False-positive rate at the current fill level."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class StreamIdFilter:
+    """
+    Bloom filter of every known stream_id, used to reject bogus links
+    before they cost a MongoDB round trip.
+
+    The filter is built lazily from the movies collection (or restored from
+    a disk snapshot plus the movies written since), kept up to date by
+    create_movie, and topped up from the database at most once per
+    refresh interval when a lookup misses, so movies added by another
+    process become visible without a query per lookup.
+    """
+
+    def __init__(self, path: str, capacity: int, error_rate: float, refresh_interval: int):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self._filter: Optional[BloomFilter] = None
+        self._synced_at = 0.0
+        self._last_refresh = 0.0
+        self._dirty = False
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._filter is not None
+
+    def load(self, collection) -> None:
+        """Restore the filter from its snapshot or build it from the collection."""
+        with self._lock:
+            if self._filter is not None:
+                return
+            started = time.monotonic()
+            if not self._load_snapshot():
+                self._build(collection)
+            self._catch_up(collection)
+            self._last_refresh = time.monotonic()
+            logger.info(
+                f"Stream ID filter ready: {self._filter.count} ids, "
+                f"{self._filter.size_bytes / 1024 / 1024:.2f} MiB, "
+                f"~{self._filter.expected_error_rate():.4%} false positives "
+                f"({time.monotonic() - started:.2f}s)"
+            )
+        self.save()
+
+    def _scan(self, collection) -> Tuple[BloomFilter, float]:
+        """Build a filter from every stream_id in the collection, with the time the scan started."""
+        total = collection.estimated_document_count()
+        bloom = BloomFilter(max(self.capacity, total * 2), self.error_rate)
+        synced_at = time.time()
+        for doc in collection.find({}, {'stream_id': 1, '_id': 0}).batch_size(10000):
+            if doc.get('stream_id'):
+                bloom.add(doc['stream_id'])
+        return bloom, synced_at
+
+    def _build(self, collection) -> None:
+        """Build a fresh filter from every stream_id in the collection."""
+        self._filter, self._synced_at = self._scan(collection)
+        self._dirty = True
+
+    def _rebuild_in_background(self, collection) -> None:
+        """
+        Replace an over-full filter with a larger one without blocking lookups.
+
+        The old filter keeps answering while the collection is scanned in a
+        thread; stream_ids written during the scan are caught up on the swap.
+        """
+        if self._rebuilding:
+            return
+        self._rebuilding = True
+
+        def rebuild() -> None:
+            try:
+                bloom, synced_at = self._scan(collection)
+                with self._lock:
+                    self._filter, self._synced_at = bloom, synced_at
+                    self._dirty = True
+                    self._catch_up(collection)
+                self.save()
+                logger.info(f"Stream ID filter rebuilt with {bloom.count} ids")
+            except Exception as e:
+                logger.error(f"Error rebuilding stream ID filter: {e}")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=rebuild, name='stream-filter-rebuild', daemon=True).start()
+
+    def _catch_up(self, collection) -> None:
+        """
+        Add stream_ids written since the last sync.
+
+        Documents are selected by the time their _id was generated rather
+        than by created_at, so imported movies, which keep their original
+        created_at but get a new _id, are picked up too.
+        """
+        since = ObjectId.from_datetime(datetime.utcfromtimestamp(self._synced_at))
+        now = time.time()
+        added = 0
+        cursor = collection.find({'_id': {'$gte': since}}, {'stream_id': 1, '_id': 0})
+        for doc in cursor:
+            if doc.get('stream_id') and doc['stream_id'] not in self._filter:
+                self._filter.add(doc['stream_id'])
+                added += 1
+        # Small overlap guards against clock skew between processes
+        self._synced_at = now - 5
+        if added:
+            self._dirty = True
+            if self._filter.count > self._filter.capacity:
+                logger.warning("Stream ID filter over capacity, rebuilding")
+                self._rebuild_in_background(collection)
+
+    def add(self, stream_id: str) -> None:
+        """Record a newly created stream_id."""
+        if self._filter is None:
+            return
+        with self._lock:
+            # The same id arrives from create_movie, the change stream and
+            # re-imports; adding it again would only inflate the count
+            if stream_id in self._filter:
+                return
+            self._filter.add(stream_id)
+            self._dirty = True
+
+    def might_contain(self, stream_id: str, collection) -> bool:
+        """
+        Check whether a stream_id may exist.
+
+        Args:
+            stream_id: The stream ID to test
+            collection: Movies collection, used to load or refresh the filter
+
+        Returns:
+            False if the stream_id definitely does not exist, True otherwise
+        """
+        if self._filter is None:
+            self.load(collection)
+        if stream_id in self._filter:
+            return True
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return False
+        with self._lock:
+            self._last_refresh = time.monotonic()
+            self._catch_up(collection)
+        self.save()
+        return stream_id in self._filter
+
+    def sync(self, collection) -> None:
+        """Catch up with movies created since the last sync, regardless of the refresh interval."""
+        if self._filter is None:
+            return
+        with self._lock:
+            self._last_refresh = time.monotonic()
+            self._catch_up(collection)
+        self.save()
+
+    def save(self) -> None:
+        """Atomically write the filter snapshot to disk if it changed."""
+        if not self.path or self._filter is None or not self._dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with self._lock:
+                header = _SNAPSHOT_HEADER.pack(
+                    _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, self._filter.num_bits,
+                    self._filter.num_hashes, self._filter.count, self._synced_at
+                )
+                bits = bytes(self._filter.bits)
+                self._dirty = False
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                f.write(bits)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self._dirty = True
+            logger.warning(f"Could not save stream ID filter snapshot: {e}")
+
+    def _load_snapshot(self) -> bool:
+        """Load the filter from disk. Returns False if no usable snapshot."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(_SNAPSHOT_HEADER.size)
+                magic, version, num_bits, num_hashes, count, synced_at = _SNAPSHOT_HEADER.unpack(header)
+                if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+                    logger.warning("Ignoring stream ID filter snapshot with unknown format")
+                    return False
+                bits = bytearray(f.read())
+            if len(bits) != (num_bits + 7) // 8:
+                logger.warning("Ignoring truncated stream ID filter snapshot")
+                return False
+        except (OSError, struct.error) as e:
+            logger.warning(f"Could not read stream ID filter snapshot: {e}")
+            return False
+
+        bloom = BloomFilter.__new__(BloomFilter)
+        bloom.num_bits, bloom.num_hashes, bloom.count, bloom.bits = num_bits, num_hashes, count, bits
+        bloom.error_rate = self.error_rate
+        bloom.capacity = int(num_bits * math.log(2) ** 2 / -math.log(self.error_rate))
+        self._filter = bloom
+        self._synced_at = synced_at
+        return True
@@ -0,0 +1,236 @@
+import html
+import re
+import logging
+from collections import OrderedDict
+from string import Formatter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_MARKDOWN_V2_SPECIAL = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+
+
+def escape_html(value: str) -> str:
+    return html.escape(value, quote=False)
+
+
+def escape_markdown_v2(value: str) -> str:
+    return _MARKDOWN_V2_SPECIAL.sub(r'\\\1', value)
+
+
+ESCAPERS: Dict[Optional[str], Callable[[str], str]] = {
+    'HTML': escape_html,
+    'MarkdownV2': escape_markdown_v2,
+    None: str
+}
+
+
+class TemplateError(ValueError):
+    """Exception for templates that cannot be parsed or use unknown fields."""
+    pass
+
+
+class MessageTemplate:
+    """
+    A format-string template parsed once and rendered with escaped values.
+
+    Literal text is treated as trusted markup for the template's parse mode;
+    every substituted value is formatted with its format spec and then
+    escaped, so user-supplied titles can never break the message markup.
+    A line whose fields are all missing is left out, so optional values
+    don't leave labels like "Shared by: @" behind.
+    """
+
+    def __init__(self, name: str, source: str, fields: Iterable[str], parse_mode: Optional[str] = 'HTML'):
+        if parse_mode not in ESCAPERS:
+            raise TemplateError(f"{name}: unsupported parse mode {parse_mode}")
+        self.name = name
+        self.source = source
+        self.parse_mode = parse_mode
+        self._escape = ESCAPERS[parse_mode]
+        self._parts = self._compile(source, set(fields))
+        self._lines = self._split_lines(self._parts)
+
+    def _compile(self, source: str, allowed: set) -> List[Tuple[str, Optional[str], str]]:
+        """Split the source into (literal, field, format_spec) parts."""
+        parts = []
+        try:
+            for literal, field, format_spec, conversion in Formatter().parse(source):
+                if field is not None:
+                    if not field or not field.isidentifier():
+                        raise TemplateError(f"{self.name}: only named fields are supported, got {{{field}}}")
+                    if field not in allowed:
+                        raise TemplateError(
+                            f"{self.name}: unknown field {{{field}}}, expected one of {sorted(allowed)}"
+                        )
+                    if conversion:
+                        raise TemplateError(f"{self.name}: conversions like !{conversion} are not supported")
+                parts.append((literal, field, format_spec or ''))
+        except ValueError as e:
+            if isinstance(e, TemplateError):
+                raise
+            raise TemplateError(f"{self.name}: {e}") from e
+        return parts
+
+    @staticmethod
+    def _split_lines(parts: List[Tuple[str, Optional[str], str]]) -> List[List[Tuple[str, Optional[str], str]]]:
+        """Regroup parts into lines, splitting literals at newlines."""
+        lines = [[]]
+        for literal, field, format_spec in parts:
+            pieces = literal.split('\n')
+            for piece in pieces[:-1]:
+                lines[-1].append((piece, None, ''))
+                lines.append([])
+            lines[-1].append((pieces[-1], field, format_spec))
+        return lines
+
+    @property
+    def fields(self) -> List[str]:
+        return [field for _, field, _ in self._parts if field]
+
+    def render(self, **values: Any) -> str:
+        """Render the template, leaving out lines whose fields are all missing."""
+        escape = self._escape
+        rendered = []
+        dropped = False
+        for line in self._lines:
+            chunks = []
+            has_fields = has_values = False
+            for literal, field, format_spec in line:
+                chunks.append(literal)
+                if field is None:
+                    continue
+                has_fields = True
+                value = values.get(field)
+                if value is None or value == '':
+                    continue
+                has_values = True
+                try:
+                    text = format(value, format_spec)
+                except (TypeError, ValueError):
+                    text = str(value)
+                chunks.append(escape(text))
+            if has_fields and not has_values:
+                dropped = True
+                continue
+            text = ''.join(chunks)
+            if dropped and not text and rendered and not rendered[-1]:
+                # Don't leave a double gap where a whole block was dropped
+                continue
+            rendered.append(text)
+            dropped = False
+        return '\n'.join(rendered)
+
+
+class RenderCache:
+    """Bounded LRU of rendered texts per stream_id, valid for one movie version."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[str, Tuple[Any, Dict[str, str]]]' = OrderedDict()
+
+    def get_or_render(self, template: MessageTemplate, stream_id: str, version: Any,
+                      render: Callable[[], str]) -> str:
+        entry = self._entries.get(stream_id)
+        if entry is None or entry[0] != version:
+            entry = self._entries[stream_id] = (version, {})
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(stream_id)
+        text = entry[1].get(template.name)
+        if text is None:
+            text = entry[1][template.name] = render()
+        return text
+
+    def invalidate(self, stream_id: str) -> None:
+        """Drop every rendered text for a movie."""
+        self._entries.pop(stream_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+MOVIE_FIELDS = (
+    'title', 'description', 'year', 'genre', 'filename', 'filesize', 'username',
+    'delete_after', 'link_ttl'
+)
+
+def _template(name: str, fields: Iterable[str]) -> MessageTemplate:
+    """Build a template from its Config text and parse mode setting."""
+    return MessageTemplate(name, getattr(Config, name), fields, Config.template_parse_mode(name))
+
+
+START_MESSAGE = _template('START_MESSAGE', ('first_name', 'username'))
+BOT_STATS_TEXT = _template(
+    'BOT_STATS_TEXT',
+    ('total_users', 'total_files', 'storage_used', 'uptime', 'total_views')
+)
+CUSTOM_CAPTION = _template('CUSTOM_CAPTION', MOVIE_FIELDS)
+DELIVERY_CAPTION = _template('DELIVERY_CAPTION', MOVIE_FIELDS)
+VERIFICATION_MESSAGE = _template('VERIFICATION_MESSAGE', MOVIE_FIELDS)
+
+caption_cache = RenderCache(Config.CACHE_SIZE)
+
+
+def format_size(size: float) -> str:
+    """Format a byte count for display."""
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if size < 1024 or unit == "TB":
+            return f"{size:.2f} {unit}"
+        size /= 1024
+
+
+def format_period(seconds: int) -> str:
+    """Format a duration in words, e.g. '1 hour 30 minutes'."""
+    parts = []
+    for unit, length in (("day", 86400), ("hour", 3600), ("minute", 60), ("second", 1)):
+        count, seconds = divmod(seconds, length)
+        if count:
+            parts.append(f"{count} {unit}{'s' if count != 1 else ''}")
+    return " ".join(parts[:2]) or "0 seconds"
+
+
+def movie_values(movie: Dict) -> Dict[str, Any]:
+    """Template values for a movie document."""
+    file_size = movie.get('file_size')
+    return {
+        'title': movie.get('title'),
+        'description': movie.get('description') or 'No description available',
+        'year': movie.get('year') or 'N/A',
+        'genre': movie.get('genre') or 'N/A',
+        'filename': movie.get('file_name') or movie.get('title'),
+        'filesize': format_size(file_size) if file_size else None,
+        'username': movie.get('uploader_username'),
+        'delete_after': format_period(Config.AUTO_DELETE_DELAY),
+        'link_ttl': format_period(Config.ACCESS_TOKEN_TTL)
+    }
+
+
+def delivery_caption(movie: Dict) -> MessageTemplate:
+    """Caption for a delivered file: CUSTOM_CAPTION for stored uploads, DELIVERY_CAPTION for links."""
+    return CUSTOM_CAPTION if movie.get('storage_message_id') else DELIVERY_CAPTION
+
+
+def render_movie(template: MessageTemplate, movie: Dict) -> str:
+    """
+    Render a per-movie template, reusing the cached text while the movie is unchanged.
+
+    Args:
+        template: One of the movie templates
+        movie: Movie document
+
+    Returns:
+        Rendered text in the template's parse mode
+    """
+    version = movie.get('updated_at') or movie.get('created_at')
+    return caption_cache.get_or_render(
+        template, movie['stream_id'], version,
+        lambda: template.render(**movie_values(movie))
+    )
+
+
+def invalidate_movie(stream_id: str) -> None:
+    """Forget rendered captions for a movie that changed."""
+    caption_cache.invalidate(stream_id)
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from telegram import Bot, Message, Update
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import CallbackContext
+
+from config import Config
+from database import DuplicateMovieError, create_movie, set_movie_links
+from dedupe import canonicalize_url, stream_id_for, telegram_fingerprint
+from shortener import create_short_links
+from templates import format_size
+from user_registry import user_registry
+
+logger = logging.getLogger(__name__)
+
+
+def storage_link(chat_id: int, message_id: int) -> str:
+    """t.me link of a message in the private storage channel."""
+    internal_id = str(chat_id)
+    if internal_id.startswith('-100'):
+        internal_id = internal_id[4:]
+    return f"https://t.me/c/{internal_id}/{message_id}"
+
+
+class UploadIntake:
+    """
+    Stores files sent by admins through a bounded queue of uploads.
+
+    The handler only validates and enqueues, so a burst of forwarded albums
+    never blocks other updates. A fixed number of worker tasks forward each
+    file to the storage channel, create the movie and its short links, and
+    reply with the result. When the queue is full new uploads are refused
+    instead of piling up in memory.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        # Created in start(): on Python 3.9 a queue binds to the event loop
+        # current at creation, which isn't the one asyncio.run() starts later
+        self._queue: 'Optional[asyncio.Queue[Message]]' = None
+        self._tasks: List[asyncio.Task] = []
+        self._bot: Optional[Bot] = None
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self, bot: Bot) -> None:
+        """Start the worker tasks. Must be called from the running event loop."""
+        self._bot = bot
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float) -> None:
+        """Finish queued uploads for up to `timeout` seconds, then stop the workers."""
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"{self._queue.qsize()} uploads still queued at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, message: Message) -> bool:
+        """Queue an upload. Returns False if the queue is full or not started yet."""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _worker(self) -> None:
+        while True:
+            message = await self._queue.get()
+            try:
+                await self._process(message)
+            except Exception as e:
+                logger.error(f"Error processing upload {message.chat_id}/{message.message_id}: {e}")
+                await self._reply(message, "❌ Failed to store this file.")
+            finally:
+                self._queue.task_done()
+
+    async def _forward(self, message: Message) -> Message:
+        """Forward the upload to the storage channel, waiting out flood limits."""
+        for attempt in range(3):
+            try:
+                return await message.forward(Config.CHANNEL_ID, disable_notification=True)
+            except RetryAfter as e:
+                if attempt == 2:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    async def _process(self, message: Message) -> None:
+        media = message.document or message.video or message.audio
+        stored = await self._forward(message)
+        stored_media = stored.document or stored.video or stored.audio or media
+
+        file_url = storage_link(stored.chat_id, stored.message_id)
+        stream_id = stream_id_for(canonicalize_url(file_url))
+        title = (message.caption or media.file_name or f"Untitled {stream_id}").strip()
+        file_info = {
+            'file_id': stored_media.file_id,
+            'file_name': media.file_name,
+            'file_size': media.file_size,
+            'mime_type': media.mime_type,
+            'storage_chat_id': stored.chat_id,
+            'storage_message_id': stored.message_id,
+            'uploader_username': message.from_user.username if message.from_user else None
+        }
+        try:
+            movie = create_movie(
+                title=title,
+                stream_id=stream_id,
+                file_url=file_url,
+                uploader_id=str(message.from_user.id) if message.from_user else None,
+                fingerprint=telegram_fingerprint(media.file_unique_id),
+                file_info=file_info
+            )
+        except DuplicateMovieError as e:
+            # The same file is already stored, so drop the new copy
+            await self._delete_stored(stored)
+            await self._reply(message, f"♻️ Already stored: {e.existing['title']}")
+            return
+        except Exception:
+            # No movie points at the copy, so don't leave it in the channel
+            await self._delete_stored(stored)
+            raise
+
+        links = await create_short_links(stream_id, f"https://t.me/{self._bot.username}?start={stream_id}")
+        set_movie_links(stream_id, links)
+        lines = [
+            f"✅ Stored: {movie['title']}",
+            f"📦 Size: {format_size(media.file_size)}" if media.file_size else "📦 Size: N/A",
+            f"🆔 Stream ID: {stream_id}"
+        ]
+        lines.extend(f"🔗 {link}" for link in links.values())
+        if not links:
+            lines.append("⚠️ No short links were created")
+        await self._reply(message, "\n".join(lines))
+
+    async def _delete_stored(self, stored: Message) -> None:
+        """Remove a storage channel copy that no movie refers to."""
+        try:
+            await self._bot.delete_message(stored.chat_id, stored.message_id)
+        except TelegramError as e:
+            logger.debug(f"Could not delete storage message {stored.message_id}: {e}")
+
+    async def _reply(self, message: Message, text: str) -> None:
+        try:
+            await message.reply_text(text, disable_web_page_preview=True)
+        except TelegramError as e:
+            logger.debug(f"Could not reply to upload: {e}")
+
+
+upload_intake = UploadIntake(Config.UPLOAD_WORKERS, Config.UPLOAD_QUEUE_SIZE)
+
+
+async def handle_upload(update: Update, context: CallbackContext) -> None:
+    """Validate an admin's document, video or audio upload and queue it for storage."""
+    message = update.message
+    if not user_registry.is_admin(update.effective_user.id):
+        await message.reply_text("⚠️ Only admins can upload files!")
+        return
+
+    if not Config.CHANNEL_ID:
+        await message.reply_text("⚠️ CHANNEL_ID is not set, files cannot be stored.")
+        return
+
+    media = message.document or message.video or message.audio
+    if not Config.is_mime_type_allowed(media.mime_type):
+        await message.reply_text(f"❌ File type not allowed: {media.mime_type or 'unknown'}")
+        return
+    if media.file_size and media.file_size > Config.MAX_FILE_SIZE:
+        await message.reply_text(
+            f"❌ File too large: {format_size(media.file_size)} "
+            f"(max {format_size(Config.MAX_FILE_SIZE)})"
+        )
+        return
+
+    if not upload_intake.submit(message):
+        await message.reply_text("⏳ Too many uploads in progress. Please send this file again in a minute.")
@@ -0,0 +1,198 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from pymongo import UpdateOne
+from telegram import Update
+from telegram.ext import Application, ApplicationHandlerStop, CallbackContext, TypeHandler
+
+from config import Config
+from models import users
+
+logger = logging.getLogger(__name__)
+
+
+class UserRegistry:
+    """
+    Records users in the users collection through a write-behind buffer.
+
+    Activity is coalesced per user in memory and written with a single
+    unordered bulk_write of upserts on each flush, so a busy user costs one
+    write per flush interval rather than one per update. Banned and admin
+    users are mirrored in in-memory sets so permission checks never hit
+    the database.
+    """
+
+    def __init__(self, collection, flush_size: int = 500):
+        self.collection = collection
+        self.flush_size = flush_size
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._banned: Set[str] = set()
+        self._admins: Set[str] = {str(admin_id) for admin_id in Config.ADMINS}
+
+    def touch(self, telegram_id: int, main_bot: bool = False) -> bool:
+        """
+        Record activity for a user.
+
+        Args:
+            telegram_id: The user's Telegram ID
+            main_bot: Whether the update came to the main bot, which makes
+                the user reachable for broadcasts again
+
+        Returns:
+            True if the buffer has reached flush_size and should be flushed
+        """
+        key = str(telegram_id)
+        now = datetime.utcnow()
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {'first_seen': now, 'last_active': now, 'main_bot': main_bot}
+        else:
+            entry['last_active'] = now
+            entry['main_bot'] = entry['main_bot'] or main_bot
+        return len(self._pending) >= self.flush_size
+
+    def flush(self) -> int:
+        """
+        Write buffered activity to the database.
+
+        Returns:
+            Number of users written
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        operations = []
+        for key, entry in pending.items():
+            update = {
+                '$setOnInsert': {
+                    'joined_date': entry['first_seen'],
+                    'is_admin': key in self._admins,
+                    'is_banned': False
+                },
+                '$max': {'last_active': entry['last_active']}
+            }
+            if entry['main_bot']:
+                update['$unset'] = {'unreachable_main': ''}
+            operations.append(UpdateOne({'telegram_id': key}, update, upsert=True))
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Error flushing {len(operations)} user updates: {e}")
+            # Put the batch back, keeping the earliest and latest timestamps
+            for key, entry in pending.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = entry
+                else:
+                    current['first_seen'] = min(current['first_seen'], entry['first_seen'])
+                    current['main_bot'] = current['main_bot'] or entry['main_bot']
+            return 0
+        return len(operations)
+
+    def refresh_roles(self) -> None:
+        """Reload the banned and admin sets from the database."""
+        try:
+            banned = set()
+            admins = {str(admin_id) for admin_id in Config.ADMINS}
+            cursor = self.collection.find(
+                {'$or': [{'is_banned': True}, {'is_admin': True}]},
+                {'telegram_id': 1, 'is_banned': 1, 'is_admin': 1, '_id': 0}
+            )
+            for doc in cursor:
+                if doc.get('is_banned'):
+                    banned.add(doc['telegram_id'])
+                if doc.get('is_admin'):
+                    admins.add(doc['telegram_id'])
+            self._banned, self._admins = banned, admins
+        except Exception as e:
+            logger.error(f"Error refreshing user roles: {e}")
+
+    def is_banned(self, telegram_id: int) -> bool:
+        return str(telegram_id) in self._banned
+
+    def is_admin(self, telegram_id: int) -> bool:
+        return str(telegram_id) in self._admins
+
+    def set_banned(self, telegram_id: int, banned: bool) -> None:
+        """Ban or unban a user, updating the database and the local set."""
+        key = str(telegram_id)
+        self.collection.update_one(
+            {'telegram_id': key},
+            {
+                '$set': {'is_banned': banned},
+                '$setOnInsert': {'joined_date': datetime.utcnow(), 'is_admin': key in self._admins}
+            },
+            upsert=True
+        )
+        if banned:
+            self._banned.add(key)
+        else:
+            self._banned.discard(key)
+
+    def apply_roles(self, telegram_id: str, banned: Optional[bool] = None,
+                    admin: Optional[bool] = None) -> None:
+        """Apply a role change made elsewhere to the local sets."""
+        key = str(telegram_id)
+        if banned is not None:
+            if banned:
+                self._banned.add(key)
+            else:
+                self._banned.discard(key)
+        if admin is not None:
+            if admin or int(key) in Config.ADMINS:
+                self._admins.add(key)
+            else:
+                self._admins.discard(key)
+
+    def count(self) -> int:
+        """Estimated number of stored users; users still in the write-behind buffer are not counted."""
+        return self.collection.estimated_document_count()
+
+
+user_registry = UserRegistry(users, flush_size=Config.USER_FLUSH_SIZE)
+
+
+async def _track(update: Update, context: CallbackContext, main_bot: bool) -> None:
+    user = update.effective_user
+    if not user:
+        return
+    if user_registry.touch(user.id, main_bot):
+        context.application.create_task(_flush_users(context))
+    if user_registry.is_banned(user.id):
+        raise ApplicationHandlerStop
+
+
+async def track_user(update: Update, context: CallbackContext) -> None:
+    """Record the sender of every update and stop processing for banned users."""
+    await _track(update, context, main_bot=False)
+
+
+async def track_main_bot_user(update: Update, context: CallbackContext) -> None:
+    """Like track_user, for the main bot, whose users can receive broadcasts."""
+    await _track(update, context, main_bot=True)
+
+
+async def _flush_users(context: CallbackContext) -> None:
+    user_registry.flush()
+
+
+async def _refresh_roles(context: CallbackContext) -> None:
+    user_registry.refresh_roles()
+
+
+def register_user_tracking(application: Application, with_jobs: bool = True, main_bot: bool = False) -> None:
+    """
+    Add user tracking ahead of all other handlers and schedule buffer flushes.
+
+    Args:
+        application: The bot application
+        with_jobs: Whether this application runs the flush and refresh jobs;
+            only one application per process needs to
+        main_bot: Whether this is the main bot, which sends broadcasts
+    """
+    application.add_handler(TypeHandler(Update, track_main_bot_user if main_bot else track_user), group=-1)
+    if with_jobs:
+        user_registry.refresh_roles()
+        application.job_queue.run_repeating(_flush_users, interval=Config.USER_FLUSH_INTERVAL)
+        application.job_queue.run_repeating(_refresh_roles, interval=Config.USER_ROLES_REFRESH)
@@ -1,11 +1,23 @@
 import os
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, MessageHandler, filters, CallbackContext, CallbackQueryHandler
-from database import get_movie_by_stream_id, verify_url_token
-from datetime import datetime, timedelta
+from database import (
+    get_movie_by_stream_id, verify_url_token, load_stream_filter,
+    create_access_token, get_access_token, stream_filter
+)
 from config import Config
-import secrets
+from expiry import schedule_deletion, register_expiry_sweeper
+from user_registry import user_registry, register_user_tracking
+from log_shipper import install_log_shipper
+from templates import VERIFICATION_MESSAGE, CUSTOM_CAPTION, DELIVERY_CAPTION, format_period, render_movie
+from forward_guard import forwarding_policy
+from worker_pool import register_worker, get_worker_state, worker_directory
+from popularity import popularity_tracker, register_popularity, prewarm
+from lifecycle import Lifecycle
+from invalidation import create_invalidation_bus
+from rate_limiter import create_rate_limiter, InFlightTracker, THROTTLED_TEXT, IN_FLIGHT_TEXT
 import asyncio
 from aiohttp import web
 
@@ -13,54 +25,24 @@ from aiohttp import web
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Store verified users and their access tokens
-verified_users = {}
+# Per-user throttling for link verification and file delivery
+verify_limiter = create_rate_limiter('verify', Config.VERIFY_RATE_LIMIT, Config.RATE_LIMIT_WINDOW)
+delivery_limiter = create_rate_limiter('delivery', Config.DELIVERY_RATE_LIMIT, Config.RATE_LIMIT_WINDOW)
 
-# Store message IDs for auto-deletion
-auto_delete_messages = {}
-
-def generate_access_token():
-    """Generate a random access token."""
-    return secrets.token_urlsafe(32)
-
-async def restrict_user_forwarding(update: Update, context: CallbackContext):
-    """Restrict user from forwarding messages."""
-    try:
-        chat_id = update.effective_chat.id
-        permissions = ChatPermissions(
-            can_send_messages=True,
-            can_send_media_messages=True,
-            can_send_other_messages=True,
-            can_add_web_page_previews=True,
-            can_send_polls=True,
-            can_change_info=False,
-            can_invite_users=True,
-            can_pin_messages=False
-        )
-        await context.bot.restrict_chat_member(chat_id, update.effective_user.id, permissions)
-    except Exception as e:
-        logger.error(f"Error restricting user forwarding: {e}")
-
-async def schedule_message_deletion(context: CallbackContext, chat_id: int, message_id: int, delay: int = 1800):
-    """Schedule message deletion after specified delay."""
-    try:
-        await asyncio.sleep(delay)
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-        # Send deletion notification
-        notification = await context.bot.send_message(
-            chat_id=chat_id,
-            text="⚠️ File has been automatically deleted for security reasons."
-        )
-        # Delete notification after 10 seconds
-        await asyncio.sleep(10)
-        await context.bot.delete_message(chat_id=chat_id, message_id=notification.message_id)
-    except Exception as e:
-        logger.error(f"Error in scheduled message deletion: {e}")
+# (user_id, stream_id) pairs with a file send in progress
+sends_in_flight = InFlightTracker()
 
 async def handle_worker_verification(update: Update, context: CallbackContext) -> None:
     """Handle URL verification and provide download/stream options in worker bot."""
     try:
         message = update.message
+        user_id = update.effective_user.id
+        
+        if not verify_limiter.hit(user_id):
+            if verify_limiter.should_notify(user_id):
+                await message.reply_text(THROTTLED_TEXT)
+            return
+        
         if not message.text or not (message.text.startswith('http://') or message.text.startswith('https://')):
             await message.reply_text(
                 "Please send a verified shortened URL from the main bot."
@@ -68,7 +50,6 @@ async def handle_worker_verification(update: Update, context: CallbackContext) -
             return
 
         url = message.text.strip()
-        user_id = update.effective_user.id
         
         # Verify the URL and get stream_id
         verification = verify_url_token(url)
@@ -80,6 +61,18 @@ async def handle_worker_verification(update: Update, context: CallbackContext) -
             return
         
         stream_id = verification['stream_id']
+        
+        # A flood-limited worker hands new users to a healthy one
+        state = get_worker_state(context.application)
+        if state.throttled:
+            other = worker_directory.pick(stream_id, exclude=state.bot_id)
+            if other:
+                await message.reply_text(
+                    f"⏳ This bot is busy right now.\n"
+                    f"Please send your link to @{other['username']} instead."
+                )
+                return
+        
         movie = get_movie_by_stream_id(stream_id)
         
         if not movie:
@@ -88,42 +81,29 @@ async def handle_worker_verification(update: Update, context: CallbackContext) -
             )
             return
         
-        # Generate temporary access token
-        access_token = generate_access_token()
-        verified_users[user_id] = {
-            'token': access_token,
-            'stream_id': stream_id,
-            'expires': datetime.now() + timedelta(minutes=30)
-        }
-        
-        # Create keyboard with download and stream options
-        keyboard = [
-            [InlineKeyboardButton("📥 Download", callback_data=f"dl_{access_token}")],
-            [InlineKeyboardButton("▶️ Stream", callback_data=f"str_{access_token}")]
-        ]
+        # Generate temporary access token, removed by the TTL index on expiry
+        access_token = create_access_token(user_id, stream_id, Config.ACCESS_TOKEN_TTL)
+        
+        # Create keyboard with download and stream options. Stored uploads are
+        # copied from the storage channel as they were sent, so they get one button
+        if movie.get('storage_message_id'):
+            keyboard = [[InlineKeyboardButton("📥 Get file", callback_data=f"dl_{access_token}")]]
+        else:
+            keyboard = [
+                [InlineKeyboardButton("📥 Download", callback_data=f"dl_{access_token}")],
+                [InlineKeyboardButton("▶️ Stream", callback_data=f"str_{access_token}")]
+            ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Send verification message
         verification_msg = await message.reply_text(
-            f"✅ URL Verified Successfully!\n\n"
-            f"🎥 *{movie['title']}*\n"
-            f"📝 {movie.get('description', 'No description available')}\n"
-            f"📅 Year: {movie.get('year', 'N/A')}\n"
-            f"🎭 Genre: {movie.get('genre', 'N/A')}\n\n"
-            f"⚠️ Links expire in 30 minutes!\n"
-            f"⚠️ Files will be automatically deleted after 30 minutes!\n"
-            f"⚠️ Forwarding is disabled for security!\n\n"
-            f"Choose your preferred option:",
-            parse_mode='Markdown',
+            render_movie(VERIFICATION_MESSAGE, movie),
+            parse_mode=VERIFICATION_MESSAGE.parse_mode,
             reply_markup=reply_markup
         )
         
         # Schedule verification message deletion
-        asyncio.create_task(schedule_message_deletion(
-            context, 
-            verification_msg.chat_id, 
-            verification_msg.message_id
-        ))
+        schedule_deletion(context.bot.id, verification_msg.chat_id, verification_msg.message_id)
 
     except Exception as e:
         logger.error(f"Error in worker verification: {e}")
@@ -135,77 +115,159 @@ async def handle_download_stream_options(update: Update, context: CallbackContex
         query = update.callback_query
         user_id = update.effective_user.id
         
-        if user_id not in verified_users:
-            await query.answer("Please verify the URL first!")
-            return
-            
-        user_data = verified_users[user_id]
-        if datetime.now() > user_data['expires']:
+        # Tokens are URL-safe base64 and may themselves contain '_'
+        action, token = query.data.split('_', 1)
+        user_data = get_access_token(token)
+        if not user_data:
             await query.answer("Access token expired! Please verify again.")
-            del verified_users[user_id]
             return
             
-        action, token = query.data.split('_')
-        if token != user_data['token']:
+        if user_data['user_id'] != user_id:
             await query.answer("Invalid access token!")
             return
             
-        movie = get_movie_by_stream_id(user_data['stream_id'])
-        if not movie:
-            await query.answer("Movie not found!")
+        # Duplicate taps during a send don't count against the delivery quota
+        send_key = (user_id, user_data['stream_id'])
+        if not sends_in_flight.try_acquire(send_key):
+            await query.answer(IN_FLIGHT_TEXT)
             return
             
-        # Restrict forwarding for the user
-        await restrict_user_forwarding(update, context)
+        if not delivery_limiter.hit(user_id):
+            sends_in_flight.release(send_key)
+            await query.answer(THROTTLED_TEXT)
+            return
             
-        # Send file with protection
-        if action == 'dl':
-            sent_message = await context.bot.send_document(
-                chat_id=update.effective_chat.id,
-                document=movie['file_url'],
-                caption=f"🎥 {movie['title']}\n\n⚠️ This file will be deleted in 30 minutes!",
-                protect_content=True,  # Prevent forwarding
-                reply_to_message_id=query.message.message_id,
-                disable_notification=True
-            )
-        else:  # Stream
-            sent_message = await context.bot.send_video(
-                chat_id=update.effective_chat.id,
-                video=movie['file_url'],
-                caption=f"🎥 {movie['title']}\n\n⚠️ This file will be deleted in 30 minutes!",
-                protect_content=True,  # Prevent forwarding
-                reply_to_message_id=query.message.message_id,
-                disable_notification=True,
-                supports_streaming=True
-            )
+        state = get_worker_state(context.application)
+        state.inflight += 1
+        try:
+            sent_message = await send_movie_file(update, context, action, user_data['stream_id'])
+        except RetryAfter as e:
+            state.throttle(e.retry_after)
+            await query.answer("⏳ This bot is busy right now. Please try again in a minute.")
+            return
+        finally:
+            state.inflight -= 1
+            sends_in_flight.release(send_key)
+            
+        if not sent_message:
+            await query.answer("Movie not found!")
+            return
+        
+        popularity_tracker.record_view(user_data['stream_id'])
         
         # Schedule file deletion
-        asyncio.create_task(schedule_message_deletion(
-            context,
-            sent_message.chat_id,
-            sent_message.message_id
-        ))
+        schedule_deletion(context.bot.id, update.effective_chat.id, sent_message.message_id)
         
-        await query.answer("File sent! It will be automatically deleted in 30 minutes.")
+        await query.answer(f"File sent! It will be automatically deleted in {format_period(Config.AUTO_DELETE_DELAY)}.")
             
     except Exception as e:
         logger.error(f"Error handling download/stream options: {e}")
         await query.answer("Error processing your request. Please try again.")
 
+async def send_movie_file(update: Update, context: CallbackContext, action: str, stream_id: str):
+    """
+    Send the movie as a protected document or video.
+    
+    Returns the sent Message, a MessageId when copied from the storage
+    channel, or None if the movie is gone.
+    """
+    movie = get_movie_by_stream_id(stream_id)
+    if not movie:
+        return None
+        
+    # Restrict forwarding where the chat type needs it, without delaying the send
+    forwarding_policy.protect(context.application, update.effective_chat, update.effective_user.id)
+        
+    # Uploaded files are copied from the storage channel, which needs no file_id.
+    # The copy keeps the uploaded media type, so `action` doesn't apply here
+    if movie.get('storage_message_id'):
+        return await context.bot.copy_message(
+            chat_id=update.effective_chat.id,
+            from_chat_id=movie['storage_chat_id'],
+            message_id=movie['storage_message_id'],
+            caption=render_movie(CUSTOM_CAPTION, movie),
+            parse_mode=CUSTOM_CAPTION.parse_mode,
+            protect_content=True,  # Prevent forwarding
+            reply_to_message_id=update.callback_query.message.message_id,
+            disable_notification=True
+        )
+        
+    # Send file with protection, reusing this bot's file_id when it has one
+    state = get_worker_state(context.application)
+    kind = 'document' if action == 'dl' else 'video'
+    file_id = state.get_file_id(stream_id, kind)
+    try:
+        sent_message = await _send_media(context, update, movie, kind, file_id or movie['file_url'])
+    except BadRequest:
+        if not file_id:
+            raise
+        # Stale file_id: fall back to the original source
+        state.forget_file_id(stream_id, kind)
+        file_id = None
+        sent_message = await _send_media(context, update, movie, kind, movie['file_url'])
+    
+    media = sent_message.document or sent_message.video
+    if media and media.file_id != file_id:
+        state.set_file_id(stream_id, kind, media.file_id)
+    return sent_message
+
+async def _send_media(context: CallbackContext, update: Update, movie: dict, kind: str, source: str):
+    """Send a movie as a protected document or streamable video."""
+    query = update.callback_query
+    if kind == 'document':
+        return await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=source,
+            caption=render_movie(DELIVERY_CAPTION, movie),
+            parse_mode=DELIVERY_CAPTION.parse_mode,
+            protect_content=True,  # Prevent forwarding
+            reply_to_message_id=query.message.message_id,
+            disable_notification=True
+        )
+    return await context.bot.send_video(
+        chat_id=update.effective_chat.id,
+        video=source,
+        caption=render_movie(DELIVERY_CAPTION, movie),
+        parse_mode=DELIVERY_CAPTION.parse_mode,
+        protect_content=True,  # Prevent forwarding
+        reply_to_message_id=query.message.message_id,
+        disable_notification=True,
+        supports_streaming=True
+    )
+
 async def web_app():
     """Create web app for Heroku."""
     app = web.Application()
     return app
 
+def build_worker_application(token: str, primary: bool) -> Application:
+    """Create the Application for one worker token."""
+    # Updates run concurrently so one multi-GB send doesn't block other users
+    application = Application.builder().token(token).concurrent_updates(True).build()
+    
+    # Shared buffers only need flushing from one application
+    register_user_tracking(application, with_jobs=primary)
+    if primary:
+        register_popularity(application)
+    register_expiry_sweeper(application)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_worker_verification))
+    application.add_handler(CallbackQueryHandler(handle_download_stream_options))
+    return application
+
 async def main():
-    """Start the bot."""
+    """Start one worker bot per configured token and run until a stop signal, then drain."""
+    applications = []
+    runner = None
+    lifecycle = Lifecycle(Config.SHUTDOWN_TIMEOUT)
+    invalidation_bus = create_invalidation_bus('worker')
     try:
-        # Initialize bot application
-        application = Application.builder().token(Config.WORKER_BOT_TOKEN).build()
+        # Load the stream ID filter before taking any links
+        load_stream_filter()
         
-        # Add handlers
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_worker_verification))
-        application.add_handler(CallbackQueryHandler(handle_download_stream_options))
+        applications = [
+            build_worker_application(token, primary=(index == 0))
+            for index, token in enumerate(Config.WORKER_BOT_TOKENS)
+        ]
         
         # Get port from environment variable
         port = int(os.environ.get('PORT', '8443'))
@@ -219,20 +281,46 @@ async def main():
         
         logger.info(f"Web app is listening on port {port}")
         
-        # Start the bot
-        await application.initialize()
-        await application.start()
-        await application.run_polling()
+        # Warm caches for the most popular movies before taking traffic
+        states = []
+        for application in applications:
+            await application.initialize()
+            states.append(register_worker(application))
+        prewarm(states)
+        
+        # Keep caches coherent with other processes' writes from here on
+        invalidation_bus.start(asyncio.get_running_loop())
+        
+        # Start the bots
+        log_shipper = None
+        for application in applications:
+            await application.start()
+            await application.updater.start_polling()
+            if application is applications[0]:
+                log_shipper = install_log_shipper(application.bot)
+            logger.info(f"Worker bot @{application.bot.username} started")
+        
+        logger.info(f"{len(applications)} worker bot(s) started successfully!")
         
-        logger.info("Worker bot started successfully!")
+        # Pending deletions already live in the deliveries collection; only
+        # in-memory buffers need flushing on the way out
+        lifecycle.on_shutdown(user_registry.flush)
+        lifecycle.on_shutdown(popularity_tracker.persist)
+        lifecycle.on_shutdown(invalidation_bus.stop)
+        lifecycle.on_shutdown(stream_filter.save)
+        if log_shipper:
+            lifecycle.on_shutdown(log_shipper.stop)
         
-        # Keep the app running
-        while True:
-            await asyncio.sleep(3600)
+        await lifecycle.wait()
             
     except Exception as e:
         logger.error(f"Error starting worker bot: {e}")
         raise
+    finally:
+        if applications:
+            await lifecycle.drain(applications)
+        if runner is not None:
+            await runner.cleanup()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,194 @@
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from telegram.ext import Application, CallbackContext
+
+from config import Config
+from models import workers, worker_file_ids
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerState:
+    """
+    Per-token state of one worker bot.
+
+    Telegram file_ids are only valid for the bot that received them, so each
+    worker keeps its own file_id cache, backed by the worker_file_ids
+    collection. Flood-wait state is also per token.
+    """
+
+    def __init__(self, bot_id: int, username: str, cache_size: int = Config.CACHE_SIZE):
+        self.bot_id = bot_id
+        self.username = username
+        self.inflight = 0
+        self.throttled_until = 0.0
+        self.cache_size = cache_size
+        self._file_ids: 'OrderedDict[str, str]' = OrderedDict()
+
+    @property
+    def throttled(self) -> bool:
+        return time.time() < self.throttled_until
+
+    def throttle(self, seconds: float) -> None:
+        """Mark the token as flood-limited and publish it so new users go elsewhere."""
+        self.throttled_until = max(self.throttled_until, time.time() + seconds)
+        logger.warning(f"Worker @{self.username} throttled for {seconds}s")
+        self.publish()
+
+    def get_file_id(self, stream_id: str, kind: str) -> Optional[str]:
+        """
+        Cached Telegram file_id of a movie for this bot, if it was sent before.
+
+        Args:
+            stream_id: The movie's stream ID
+            kind: 'document' or 'video', since Telegram file_ids are typed
+
+        Returns:
+            The file_id, or None if this bot never sent the movie that way
+        """
+        key = f"{kind}:{stream_id}"
+        file_id = self._file_ids.get(key)
+        if file_id is not None:
+            self._file_ids.move_to_end(key)
+            return file_id
+        doc = worker_file_ids.find_one(
+            {'bot_id': self.bot_id, 'stream_id': stream_id, 'kind': kind}, {'file_id': 1}
+        )
+        if doc:
+            self._remember(key, doc['file_id'])
+            return doc['file_id']
+        return None
+
+    def set_file_id(self, stream_id: str, kind: str, file_id: str) -> None:
+        self._remember(f"{kind}:{stream_id}", file_id)
+        worker_file_ids.update_one(
+            {'bot_id': self.bot_id, 'stream_id': stream_id, 'kind': kind},
+            {'$set': {'file_id': file_id, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+
+    def forget_file_id(self, stream_id: str, kind: str) -> None:
+        self._file_ids.pop(f"{kind}:{stream_id}", None)
+        worker_file_ids.delete_one({'bot_id': self.bot_id, 'stream_id': stream_id, 'kind': kind})
+
+    def preload_file_ids(self, stream_ids: List[str]) -> int:
+        """
+        Load this bot's stored file_ids for several movies in one query.
+
+        Returns:
+            Number of file_ids loaded
+        """
+        if not stream_ids:
+            return 0
+        loaded = 0
+        for doc in worker_file_ids.find(
+            {'bot_id': self.bot_id, 'stream_id': {'$in': stream_ids}},
+            {'stream_id': 1, 'kind': 1, 'file_id': 1}
+        ):
+            self._remember(f"{doc['kind']}:{doc['stream_id']}", doc['file_id'])
+            loaded += 1
+        return loaded
+
+    def _remember(self, key: str, file_id: str) -> None:
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        if len(self._file_ids) > self.cache_size:
+            self._file_ids.popitem(last=False)
+
+    def publish(self) -> None:
+        """Write this worker's health and load to the workers collection."""
+        try:
+            workers.update_one(
+                {'_id': self.bot_id},
+                {'$set': {
+                    'username': self.username,
+                    'inflight': self.inflight,
+                    'throttled_until': datetime.utcfromtimestamp(self.throttled_until),
+                    'heartbeat_at': datetime.utcnow()
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error publishing worker state for @{self.username}: {e}")
+
+
+def get_worker_state(application: Application) -> WorkerState:
+    return application.bot_data['worker']
+
+
+async def _heartbeat(context: CallbackContext) -> None:
+    get_worker_state(context.application).publish()
+
+
+def register_worker(application: Application) -> WorkerState:
+    """Attach per-token state to an initialized worker application and start its heartbeat."""
+    bot = application.bot
+    state = WorkerState(bot.id, bot.username)
+    application.bot_data['worker'] = state
+    state.publish()
+    application.job_queue.run_repeating(_heartbeat, interval=Config.WORKER_HEARTBEAT_INTERVAL)
+    return state
+
+
+def _rendezvous_score(key: str, bot_id: int) -> int:
+    digest = hashlib.blake2b(f"{key}:{bot_id}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class WorkerDirectory:
+    """
+    Picks the worker bot a user should be sent to.
+
+    Healthy workers (recent heartbeat, not flood-limited) are ranked by
+    rendezvous hashing on the stream_id, so the same movie keeps going to
+    the same bot and reuses its cached file_id. If the preferred worker is
+    much busier than the least-loaded one, the least-loaded one is used
+    instead.
+    """
+
+    def __init__(self, refresh_interval: int = 5):
+        self.refresh_interval = refresh_interval
+        self._workers: List[Dict] = []
+        self._loaded_at = 0.0
+
+    def healthy_workers(self) -> List[Dict]:
+        now = time.monotonic()
+        if now - self._loaded_at >= self.refresh_interval:
+            utcnow = datetime.utcnow()
+            try:
+                self._workers = list(workers.find({
+                    'heartbeat_at': {'$gt': utcnow - timedelta(seconds=Config.WORKER_HEARTBEAT_INTERVAL * 3)},
+                    'throttled_until': {'$lte': utcnow}
+                }))
+                self._loaded_at = now
+            except Exception as e:
+                logger.error(f"Error loading worker directory: {e}")
+        return self._workers
+
+    def pick(self, key: str, exclude: Optional[int] = None) -> Optional[Dict]:
+        """
+        Choose a worker for a stream_id (or user ID).
+
+        Args:
+            key: Stream ID, or user ID when no movie is known yet
+            exclude: Bot ID to skip, e.g. the worker handing a user off
+
+        Returns:
+            Worker document with 'username', or None if no worker is healthy
+        """
+        candidates = [w for w in self.healthy_workers() if w['_id'] != exclude]
+        if not candidates:
+            return None
+        preferred = max(candidates, key=lambda w: _rendezvous_score(key, w['_id']))
+        least_loaded = min(candidates, key=lambda w: w.get('inflight', 0))
+        if preferred.get('inflight', 0) - least_loaded.get('inflight', 0) > Config.WORKER_LOAD_SLACK:
+            return least_loaded
+        return preferred
+
+
+worker_directory = WorkerDirectory()